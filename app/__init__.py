@@ -15,6 +15,15 @@ from flask_uploads import UploadSet, configure_uploads, IMAGES, \
 
 from flaskext.markdown import Markdown
 
+from app.avatars import AvatarIndex
+from app.image_store import ImageStore
+from app.instrumentation import QueryStats
+from app.jobs import JobQueue
+from app.notifications import NotificationHub
+from app.last_seen import LastSeenBuffer
+from app.reference_cache import ReferenceCache
+from app.uploads import UploadRequest
+from app.render_cache import RenderCache
 from config import Config, is_heroku
 
 db = SQLAlchemy()
@@ -31,12 +40,25 @@ babel = Babel()
 
 photos = UploadSet("photos", IMAGES)
 
-backups = UploadSet("backups", DATA)
+# JSON dumps and backup archives
+backups = UploadSet("backups", DATA + ("zip",))
 archives = UploadSet("archives", ARCHIVES)
 
+avatars = AvatarIndex()
+image_store = ImageStore()
+jobs = JobQueue()
+last_seen_buffer = LastSeenBuffer()
+notification_hub = NotificationHub()
+# rendered shopping list documents
+docx_cache = RenderCache()
+query_stats = QueryStats()
+# PKU and festival selections
+reference_cache = ReferenceCache()
+
 
 def create_app(config_class=Config):
     app = Flask(__name__)
+    app.request_class = UploadRequest
     app.view_functions["static"] = login_required(app.send_static_file)
     app.config.from_object(config_class)
     app.jinja_env.globals.update(is_heroku=is_heroku)
@@ -47,6 +69,14 @@ def create_app(config_class=Config):
     bootstrap.init_app(app)
     moment.init_app(app)
     babel.init_app(app)
+    avatars.init_app(app)
+    image_store.init_app(app)
+    jobs.init_app(app)
+    last_seen_buffer.init_app(app)
+    notification_hub.init_app(app)
+    docx_cache.init_app(app)
+    query_stats.init_app(app)
+    reference_cache.init_app(app)
 
     from app.errors import bp as errors_bp
     app.register_blueprint(errors_bp)
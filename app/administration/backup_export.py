@@ -1,17 +1,34 @@
+import gzip
 import os
-from zipfile import ZipFile
+from datetime import datetime, timedelta
+from functools import partial
+from hashlib import sha256
+from zipfile import ZIP_STORED, ZipFile
 
 from alembic.runtime.migration import MigrationContext
 from flask import current_app as ca
-from flask import jsonify
+from flask import json, jsonify, Response, stream_with_context
 from sqlalchemy import create_engine
 
 import app.models as m
-from app import session
-from app.festival.logic import get_participants, get_sharers
-from app.main.utils import send_file
+from app import image_store, session
+from app.main.utils import send_attachment
 from config import Config
 
+# number of rows read and serialized at once by the streaming export
+EXPORT_CHUNK_SIZE = 1000
+
+# layout of the backup archive, see stream_archive
+ARCHIVE_FORMAT = 1
+ARCHIVE_TOC = "toc.json"
+ARCHIVE_MANIFEST = "images/manifest.json"
+ARCHIVE_TABLE_DIR = "tables/"
+ARCHIVE_IMAGE_DIR = "images/files/"
+
+# layout of the image backup, see zip_and_download_images
+IMAGE_MANIFEST = "manifest.json"
+IMAGE_OBJECT_DIR = "objects/"
+
 
 def get_version_number():
     db_url = ca.config["SQLALCHEMY_DATABASE_URI"]
@@ -61,11 +78,28 @@ def __build_post_dict(posts):
     return content
 
 
-def __build_festival_dict(festivals):
+def __group_ids(key_column, value_column):
+    """Reads an association table with a single query and maps each key
+    to the list of associated ids"""
+    result = {}
+    rows = session.query(key_column, value_column).order_by(key_column, value_column)
+    for key, value in rows:
+        result.setdefault(key, []).append(value)
+    return result
+
+
+def __load_participant_ids():
+    return __group_ids(m.participants.c.festival_id, m.participants.c.participant_id)
+
+
+def __load_sharer_ids():
+    return __group_ids(m.sharers.c.invoice_id, m.sharers.c.sharer_id)
+
+
+def __build_festival_dict(festivals, participant_ids):
     content = []
     for f in festivals:
-        participants = get_participants(f.id)
-        p_ids = [p[0] for p in participants]
+        p_ids = participant_ids.get(f.id, [])
         festival = {
             "id": f.id,
             "title": f.title,
@@ -98,15 +132,14 @@ def __build_chronicle_dict(chronicles):
     return content
 
 
-def __build_invoice_dict(invoices):
+def __build_invoice_dict(invoices, sharer_ids):
     content = []
     for i in invoices:
-        sharers = get_sharers(i.id)
-        s_ids = [s[0] for s in sharers]
+        s_ids = sharer_ids.get(i.id, [])
         invoice = {
             "id": i.id,
             "title": i.title,
-            "amount": i.amount,
+            "amount_cents": i.amount_cents,
             "creditor": i.creditor_id,
             "festival": i.festival_id,
             "sharers": s_ids
@@ -123,7 +156,7 @@ def __build_transfer_dict(transfers):
             "festival": t.festival_id,
             "recipient": t.recipient_id,
             "payer": t.payer_id,
-            "amount": t.amount
+            "amount_cents": t.amount_cents
         }
         content.append(transfer)
     return content
@@ -153,7 +186,8 @@ def __build_pku_dict(pkus):
             "name": p.name,
             "abbreviation": p.abbreviation,
             "internal_name": p.internal_name,
-            "delete": p.delete
+            "delete": p.delete,
+            "package_sizes": p.package_sizes
         }
         content.append(pku)
     return content
@@ -174,6 +208,7 @@ def __build_u_item_dict(u_items):
 
 def prepare_export():
     ca.logger.info("data export triggered")
+    until = datetime.utcnow()
     users = session.query(m.User).all()
     user_output = __build_user_dict(users)
 
@@ -181,13 +216,13 @@ def prepare_export():
     post_output = __build_post_dict(posts)
 
     festivals = session.query(m.Festival).all()
-    festival_output = __build_festival_dict(festivals)
+    festival_output = __build_festival_dict(festivals, __load_participant_ids())
 
     chronicles = session.query(m.ChronicleEntry).all()
     chronicle_output = __build_chronicle_dict(chronicles)
 
     invoices = session.query(m.Invoice).all()
-    invoice_output = __build_invoice_dict(invoices)
+    invoice_output = __build_invoice_dict(invoices, __load_sharer_ids())
 
     transfers = session.query(m.Transfer).all()
     transfer_output = __build_transfer_dict(transfers)
@@ -203,6 +238,7 @@ def prepare_export():
 
     ca.logger.info("writing dump to file")
     return jsonify({"version_number": get_version_number(),
+                    "until": until.isoformat(),
                     "users": user_output,
                     "posts": post_output,
                     "festivals": festival_output,
@@ -214,21 +250,221 @@ def prepare_export():
                     "utilityItems": u_item_output})
 
 
-def zip_and_download_images():
-    ca.logger.info("zip chronicle images")
-    file_paths = __get_files(Config.UPLOAD_PATH)
-    filename = "chronicles.zip"
-    os.chdir(Config.STATIC_DIR)
-    out_path = os.path.join("chronicles", filename)
-    zip_file = ZipFile(out_path, "w")
-    with zip_file:
-        for file in file_paths:
-            split = file.split(sep="/")
-            relative_path = "/%s/%s/%s" % (split[-3], split[-2], split[-1])
-            zip_file.write(file, arcname=relative_path)
-
-    zip_file.close()
-    return send_file(Config.UPLOAD_PATH, filename, "application/zip")
+def __sections():
+    """Same sections and order as in prepare_export"""
+    return [
+        ("users", m.User, __build_user_dict),
+        ("posts", m.Post, __build_post_dict),
+        ("festivals", m.Festival,
+         partial(__build_festival_dict, participant_ids=__load_participant_ids())),
+        ("chronicle", m.ChronicleEntry, __build_chronicle_dict),
+        ("invoices", m.Invoice,
+         partial(__build_invoice_dict, sharer_ids=__load_sharer_ids())),
+        ("transfers", m.Transfer, __build_transfer_dict),
+        ("consumptionItems", m.ConsumptionItem, __build_c_item_dict),
+        ("packagingUnits", m.PackagingUnitType, __build_pku_dict),
+        ("utilityItems", m.UtilityItem, __build_u_item_dict)
+    ]
+
+
+def __chunks(model):
+    chunk = []
+    query = session.query(model).order_by(model.id).yield_per(EXPORT_CHUNK_SIZE)
+    for row in query:
+        chunk.append(row)
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def __stream_section(key, model, build):
+    yield ", {}: [".format(json.dumps(key))
+    separator = ""
+    for chunk in __chunks(model):
+        yield separator + ", ".join(json.dumps(r) for r in build(chunk))
+        separator = ", "
+    yield "]"
+
+
+def stream_export():
+    """Writes the same document as prepare_export, but table by table in
+    chunks of EXPORT_CHUNK_SIZE rows, so the dump is never held in memory"""
+    ca.logger.info("streaming data export triggered")
+    version_number = get_version_number()
+    until = datetime.utcnow()
+
+    def generate():
+        yield "{{\"version_number\": {}".format(json.dumps(version_number))
+        yield ", \"until\": {}".format(json.dumps(until.isoformat()))
+        for key, model, build in __sections():
+            yield from __stream_section(key, model, build)
+        yield "}"
+        ca.logger.info("streaming data export finished")
+
+    return Response(stream_with_context(generate()),
+                    mimetype="application/json")
+
+
+class _ArchiveOutput(object):
+    """Write-only file for ZipFile, the response generator takes the
+    written bytes after every step"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def __archive_images(archive):
+    """Adds the chronicle images to the archive and yields their manifest
+    entries"""
+    for file in __get_files(Config.UPLOAD_PATH):
+        if os.path.splitext(file)[1].lower() not in Config.UPLOAD_EXTENSIONS:
+            continue
+        path = os.path.relpath(file, Config.UPLOAD_PATH).replace(os.sep, "/")
+        name = ARCHIVE_IMAGE_DIR + path
+        digest = sha256()
+        with open(file, "rb") as source, archive.open(name, "w", force_zip64=True) as target:
+            for block in iter(lambda: source.read(64 * 1024), b""):
+                digest.update(block)
+                target.write(block)
+        yield {"path": path, "file": name, "sha256": digest.hexdigest(),
+               "size": os.path.getsize(file)}
+
+
+def stream_archive():
+    """Streams the backup as a zip archive: one gzip compressed file with
+    newline-delimited JSON per table, the chronicle images with a manifest
+    of their sha256 hashes and a table of contents. Every member can be
+    read on its own, so single tables can be restored."""
+    ca.logger.info("archive export triggered")
+    version_number = get_version_number()
+    until = datetime.utcnow()
+
+    def generate():
+        output = _ArchiveOutput()
+        toc = {"format": ARCHIVE_FORMAT,
+               "version_number": version_number,
+               "until": until.isoformat(),
+               "tables": {},
+               "images": ARCHIVE_MANIFEST}
+        with ZipFile(output, "w", ZIP_STORED) as archive:
+            for key, model, build in __sections():
+                name = "{}{}.ndjson.gz".format(ARCHIVE_TABLE_DIR, key)
+                rows = 0
+                with archive.open(name, "w", force_zip64=True) as member, \
+                        gzip.GzipFile(fileobj=member, mode="wb") as table:
+                    for chunk in __chunks(model):
+                        for r in build(chunk):
+                            table.write((json.dumps(r) + "\n").encode("utf-8"))
+                        rows += len(chunk)
+                        yield output.take()
+                toc["tables"][key] = {"file": name, "rows": rows}
+
+            manifest = []
+            for image in __archive_images(archive):
+                manifest.append(image)
+                yield output.take()
+            archive.writestr(ARCHIVE_MANIFEST, json.dumps(manifest))
+            archive.writestr(ARCHIVE_TOC, json.dumps(toc))
+        yield output.take()
+        ca.logger.info("archive export finished")
+
+    return send_attachment(stream_with_context(generate()), "backup.zip",
+                           "application/zip")
+
+
+def __watermark(model):
+    if model is m.Festival:
+        return m.Festival.modified
+    return model.updated_at
+
+
+def prepare_delta_export(since):
+    """Exports the rows created or changed since the watermark of an earlier
+    backup ("until" of the base or the previous delta) and the ids of the
+    rows deleted since then.
+
+    The timestamps are taken before the transactions commit, so a change
+    stamped just before the previous "until" might have been invisible to
+    that backup. The export reads BACKUP_DELTA_OVERLAP seconds before since
+    again, the import upserts the rows it already has."""
+    ca.logger.info("delta export since >{}< triggered".format(since))
+    until = datetime.utcnow()
+    start = since - timedelta(seconds=ca.config["BACKUP_DELTA_OVERLAP"])
+    content = {"version_number": get_version_number(),
+               "since": since.isoformat(),
+               "until": until.isoformat()}
+    for key, model, build in __sections():
+        watermark = __watermark(model)
+        rows = session.query(model).filter(watermark >= start, watermark < until) \
+            .order_by(model.id).all()
+        content[key] = build(rows)
+
+    deleted = {}
+    tombstones = session.query(m.Tombstone.table_name, m.Tombstone.row_id) \
+        .filter(m.Tombstone.deleted_at >= start, m.Tombstone.deleted_at < until) \
+        .order_by(m.Tombstone.id)
+    for table_name, row_id in tombstones:
+        deleted.setdefault(table_name, []).append(row_id)
+    content["deleted"] = deleted
+    return jsonify(content)
+
+
+def __copy_to_archive(archive, output, source_path, name):
+    with open(source_path, "rb") as source, archive.open(name, "w") as target:
+        for block in iter(lambda: source.read(64 * 1024), b""):
+            target.write(block)
+            yield output.take()
+
+
+def zip_and_download_images(since=0):
+    """Streams the chronicle images as zip archive. Every content is stored
+    once as objects/<sha256>, the manifest maps the hashes to all paths.
+    Only hashes added after the serial since are packaged, the client
+    already got the others with an earlier backup."""
+    ca.logger.info("zip chronicle images since serial >{}<".format(since))
+    serial, objects = image_store.snapshot()
+
+    def generate():
+        output = _ArchiveOutput()
+        # the images are compressed already
+        with ZipFile(output, "w", ZIP_STORED) as archive:
+            for digest, entry in sorted(objects.items()):
+                if entry["serial"] <= since:
+                    continue
+                source_path = os.path.join(Config.UPLOAD_PATH, entry["paths"][0])
+                name = IMAGE_OBJECT_DIR + digest + os.path.splitext(source_path)[1].lower()
+                if not os.path.isfile(source_path):
+                    ca.logger.warning("image >{}< is missing".format(source_path))
+                    continue
+                yield from __copy_to_archive(archive, output, source_path, name)
+            archive.writestr(IMAGE_MANIFEST, json.dumps({
+                "serial": serial,
+                "since": since,
+                "objects": {d: e["paths"] for d, e in objects.items()}
+            }))
+        yield output.take()
+
+    return send_attachment(stream_with_context(generate()), "chronicles.zip",
+                           "application/zip")
 
 
 def __get_files(dirname):
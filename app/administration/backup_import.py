@@ -1,343 +1,586 @@
+import gzip
 import json
+import os
 import shutil
-from zipfile import ZipFile
+from datetime import datetime
+from hashlib import sha256
+from zipfile import BadZipFile, ZipFile
 
 from flask import current_app as ca
-from flask import flash, redirect, url_for
+from flask import flash
 from flask_babel import _
+from sqlalchemy import bindparam, func, select
 
 import app.models as m
-from app import session
+from app import avatars, image_store, reference_cache, session
 from app.containers import UserAccessLevel
-from app.administration.backup_export import get_version_number
+from app.image_store import file_hash
+from app.administration.backup_export import ARCHIVE_FORMAT, ARCHIVE_TOC, \
+    IMAGE_MANIFEST, IMAGE_OBJECT_DIR, get_version_number
+from app.administration.backup_reader import BackupReader
+from app.administration.import_backend import IMPORT_BATCH_SIZE, backend_for, \
+    convert_rows
 from config import Config
 
-
-def __delete_from_database(items):
-    for i in items:
-        session.delete(i)
-    session.commit()
-
-
-def __handle_posts():
-    replies = session.query(m.Post).filter(m.Post.parent_id != None).all()  # noqa: E711
-    posts = session.query(m.Post).filter(m.Post.parent_id == None).all()  # noqa: E711
-    __delete_from_database(replies)
-    __delete_from_database(posts)
-
-
-def __handle_items():
-    c_items = session.query(m.ConsumptionItem).all()
-    u_items = session.query(m.UtilityItem).all()
-    __delete_from_database(c_items)
-    __delete_from_database(u_items)
-
-
-def __handle_table(table):
-    entries = session.query(table).all()
-    __delete_from_database(entries)
-
-
-def __handle_notifications():
-    __handle_table(m.Notification)
-
-
-def __handle_invoices():
-    __handle_table(m.Invoice)
-
-
-def __handle_registrations():
-    __handle_table(m.Registration)
-
-
-def __handle_transfers():
-    __handle_table(m.Transfer)
-
-
-def __handle_pkus():
-    __handle_table(m.PackagingUnitType)
-
-
-def __handle_chronicles():
-    __handle_table(m.ChronicleEntry)
-
-
-def __handle_festivals():
-    __handle_table(m.Festival)
-
-
-def __handle_users():
-    other_users = session.query(m.User).filter(
-        m.User.access_level < UserAccessLevel.OWNER).all()
-    __delete_from_database(other_users)
+# tables cleared before the import, dependent tables first
+__delete_order = [
+    m.sharers,
+    m.participants,
+    m.chroniclers,
+    m.Notification.__table__,
+    m.Registration.__table__,
+    m.Transfer.__table__,
+    m.Invoice.__table__,
+    m.ConsumptionItem.__table__,
+    m.UtilityItem.__table__,
+    m.ChronicleEntry.__table__,
+    m.PackagingUnitType.__table__,
+    m.Festival.__table__,
+    m.Tombstone.__table__
+]
+
+# tables written by the import, referenced tables first
+__import_order = [
+    m.User.__table__,
+    m.Festival.__table__,
+    m.PackagingUnitType.__table__,
+    m.Post.__table__,
+    m.ConsumptionItem.__table__,
+    m.UtilityItem.__table__,
+    m.Invoice.__table__,
+    m.Transfer.__table__,
+    m.ChronicleEntry.__table__
+]
+
+
+def __delete_from_database(owner_id):
+    ca.logger.info("start deletion of database entries before import")
+    for table in __delete_order:
+        session.execute(table.delete())
+    post = m.Post.__table__
+    session.execute(post.delete().where(post.c.parent_id.isnot(None)))
+    session.execute(post.delete())
+    # finally: delete all users except the owner
+    user = m.User.__table__
+    session.execute(user.update().values(partner_id=None))
+    session.execute(user.delete().where(user.c.id != owner_id))
+
+
+def __link_column(link_table, table):
+    return next(c for c in link_table.columns if c.references(table.c.id))
+
+
+def __upsert(backend, table, rows):
+    """Updates the rows which already exist and inserts the others"""
+    ids = [r["id"] for r in rows]
+    existing = {row_id for row_id, in session.execute(
+        select(table.c.id).where(table.c.id.in_(ids)))}
+    backend.insert(table, [r for r in rows if r["id"] not in existing])
+    updates = [dict(r, b_id=r["id"]) for r in rows if r["id"] in existing]
+    if updates:
+        session.execute(table.update().where(table.c.id == bindparam("b_id")),
+                        convert_rows(table, updates))
+
+
+def __write_batch(backend, table, rows, link_table=None, links=(), upsert=False):
+    if upsert and rows:
+        __upsert(backend, table, rows)
+        if link_table is not None:
+            # a delta contains the complete list of associated users
+            link_column = __link_column(link_table, table)
+            session.execute(link_table.delete().where(
+                link_column.in_([r["id"] for r in rows])))
+    else:
+        backend.insert(table, rows)
+    if links:
+        backend.insert(link_table, links)
+
+
+def __import_section(backend, entries, table, to_row, link_table=None, to_links=None,
+                     upsert=False):
+    """Writes the entries of a backup section in batches of
+    IMPORT_BATCH_SIZE rows"""
+    rows = []
+    links = []
+    for entry in entries:
+        rows.append(to_row(entry))
+        if to_links is not None:
+            links.extend(to_links(entry))
+        if len(rows) == IMPORT_BATCH_SIZE:
+            __write_batch(backend, table, rows, link_table, links, upsert)
+            rows = []
+            links = []
+    __write_batch(backend, table, rows, link_table, links, upsert)
+
+
+def __user_row(u):
+    return {
+        "id": u["id"],
+        "username": u["username"],
+        "registration_code": u["registration_code"],
+        "password_hash": u["password_hash"],
+        "about_me": u["about_me"],
+        "last_seen": u["last_seen"],
+        "access_level": u["access_level"],
+        "is_suspended": u["is_suspended"],
+        "beer_demand": u["beer_demand"],
+        "mixed_demand": u["mixed_demand"],
+        "water_demand": u["water_demand"],
+        "reset_code": u["reset_code"]
+    }
+
+
+def __import_users(backend, users, owner, upsert=False):
+    """The owner is updated in place, partners are set after all users exist"""
+    user = m.User.__table__
+    partners = []
+
+    def other_users():
+        for u in users:
+            user_id = owner.id if u["access_level"] == owner.access_level else u["id"]
+            if u["partner"] is not None:
+                partners.append({"b_id": user_id, "b_partner": u["partner"]})
+            if user_id == owner.id:
+                # DO NOT OVERRIDE THE PASSWORD!
+                values = __user_row(u)
+                del values["id"], values["password_hash"], values["reset_code"]
+                values = convert_rows(user, [values])[0]
+                session.execute(user.update().where(user.c.id == owner.id).values(values))
+            else:
+                yield u
+
+    __import_section(backend, other_users(), user, __user_row, upsert=upsert)
+    if partners:
+        session.execute(user.update().where(user.c.id == bindparam("b_id"))
+                        .values(partner_id=bindparam("b_partner")), partners)
+
+
+def __festival_row(f):
+    return {
+        "id": f["id"],
+        "title": f["title"],
+        "info": f["info"],
+        "creator_id": f["creator"],
+        "is_closed": f["is_closed"],
+        "update_info": f["update_info"],
+        "modified": f["modified"],
+        "end_date": f["end_date"],
+        "start_date": f["start_date"]
+    }
+
+
+def __participant_rows(f):
+    return [{"participant_id": p, "festival_id": f["id"]} for p in f["participants"]]
+
+
+def __pku_row(p):
+    return {
+        "id": p["id"],
+        "name": p["name"],
+        "abbreviation": p["abbreviation"],
+        "internal_name": p["internal_name"],
+        "delete": p["delete"],
+        "package_sizes": p.get("package_sizes")
+    }
+
+
+def __post_row(p):
+    return {
+        "id": p["id"],
+        "body": p["body"],
+        "timestamp": p["timestamp"],
+        "user_id": p["author"],
+        "is_pinned": p["is_pinned"],
+        "parent_id": p["parent"],
+        "internal_time": p["internal_time"]
+    }
+
+
+def __c_item_row(c):
+    return {
+        "id": c["id"],
+        "name": c["name"],
+        "state": c["state"],
+        "amount": c["amount"],
+        "requestor_id": c["requestor"],
+        "pku_id": c["pku"],
+        "info": c["info"]
+    }
+
+
+def __u_item_row(u):
+    return {
+        "id": u["id"],
+        "name": u["name"],
+        "owner_id": u["owner"],
+        "description": u["description"]
+    }
+
+
+def __invoice_row(i):
+    return {
+        "id": i["id"],
+        "title": i["title"],
+        "amount_cents": i["amount_cents"],
+        "creditor_id": i["creditor"],
+        "festival_id": i["festival"]
+    }
+
+
+def __sharer_rows(i):
+    return [{"sharer_id": s, "invoice_id": i["id"]} for s in i["sharers"]]
+
+
+def __transfer_row(t):
+    return {
+        "id": t["id"],
+        "festival_id": t["festival"],
+        "recipient_id": t["recipient"],
+        "payer_id": t["payer"],
+        "amount_cents": t["amount_cents"]
+    }
+
+
+def __chronicle_row(c):
+    return {
+        "id": c["id"],
+        "body": c["body"],
+        "chronicler_id": c["chronicler"],
+        "festival_id": c["festival"],
+        "internal_time": c["internal_time"],
+        "timestamp": c["timestamp"],
+        "year": c["year"]
+    }
+
+
+def __read_index(reader, local_version):
+    """Returns the version number and the byte offsets of the data sections.
+    Reading stops at a wrong version number, so a streamed export, which
+    starts with it, is rejected before any section is read."""
+    version_number = None
+    offsets = {}
+    for key in reader.members():
+        if key == "version_number":
+            version_number = reader.value()
+            if version_number != local_version:
+                break
+        else:
+            offsets[key] = reader.tell()
+            reader.skip()
+    return version_number, offsets
+
+
+def __sections(reader, offsets):
+    def section(key):
+        if key not in offsets:
+            raise ValueError("backup has no section >{}<".format(key))
+        reader.seek(offsets[key])
+        return reader.items()
+    return section
+
+
+def __watermark(reader, offsets, key):
+    if key not in offsets:
+        return None
+    reader.seek(offsets[key])
+    return datetime.fromisoformat(reader.value())
+
+
+def __import_sections(backend, section, owner, upsert=False):
+    # the sections are read in dependency order, not in file order
+    festival = m.Festival.__table__
+    post = m.Post.__table__
+    __import_users(backend, section("users"), owner, upsert)
+    __import_section(backend, section("festivals"), festival, __festival_row,
+                     m.participants, __participant_rows, upsert)
+    __import_section(backend, section("packagingUnits"), m.PackagingUnitType.__table__,
+                     __pku_row, upsert=upsert)
+    # parents have to be inserted before their replies
+    __import_section(backend, (p for p in section("posts") if p["parent"] is None),
+                     post, __post_row, upsert=upsert)
+    __import_section(backend, (p for p in section("posts") if p["parent"] is not None),
+                     post, __post_row, upsert=upsert)
+    __import_section(backend, section("consumptionItems"), m.ConsumptionItem.__table__,
+                     __c_item_row, upsert=upsert)
+    __import_section(backend, section("utilityItems"), m.UtilityItem.__table__,
+                     __u_item_row, upsert=upsert)
+    __import_section(backend, section("invoices"), m.Invoice.__table__, __invoice_row,
+                     m.sharers, __sharer_rows, upsert)
+    __import_section(backend, section("transfers"), m.Transfer.__table__,
+                     __transfer_row, upsert=upsert)
+    __import_section(backend, section("chronicle"), m.ChronicleEntry.__table__,
+                     __chronicle_row, upsert=upsert)
+
+
+def __apply_deletions(deleted):
+    for table in reversed(__import_order):
+        ids = deleted.get(table.name)
+        if not ids:
+            continue
+        for link_table in (m.participants, m.sharers, m.chroniclers):
+            for column in link_table.columns:
+                if column.references(table.c.id):
+                    session.execute(link_table.delete().where(column.in_(ids)))
+        session.execute(table.delete().where(table.c.id.in_(ids)))
+
+
+def __owner():
+    return session.query(m.User).filter_by(access_level=UserAccessLevel.OWNER).first()
+
+
+def __reset_id_counters(backend):
+    # continue the id counters after the imported rows
+    for table in __import_order:
+        max_id = session.query(func.max(table.c.id)).scalar() or 0
+        backend.reset_id_counter(table, max_id + 1)
+
+
+def __in_transaction(do_import):
+    """Runs do_import with the dialect's import backend in one transaction,
+    which is rolled back if any step fails"""
+    backend = backend_for(session)
+    backend.begin()
+    try:
+        do_import(backend)
+        session.commit()
+        reference_cache.invalidate()
+    except Exception:
+        session.rollback()
+        ca.logger.exception("import failed, all changes were rolled back")
+        flash(_("Import failed"))
+        return False
+    finally:
+        backend.end()
+    ca.logger.info("import finished")
+    return True
 
 
-def load_backup(backup):
+def __do_import(backend, reader, offsets, deltas):
+    owner = __owner()
+    __delete_from_database(owner.id)
+    ca.logger.info("start importing data from file")
+    __import_sections(backend, __sections(reader, offsets), owner)
+
+    for delta_reader, delta_offsets in deltas:
+        ca.logger.info("apply delta backup")
+        section = __sections(delta_reader, delta_offsets)
+        __import_sections(backend, section, owner, upsert=True)
+        delta_reader.seek(delta_offsets["deleted"])
+        __apply_deletions(delta_reader.value())
+    __reset_id_counters(backend)
+
+
+def __check_chain(base, deltas):
+    """Every delta has to start at or before the watermark of the backup
+    it is applied to, otherwise changes would be missing"""
+    if "since" in base[1]:
+        raise ValueError("a delta backup can't be imported without its base")
+    watermark = __watermark(*base, "until")
+    for reader, offsets in deltas:
+        since = __watermark(reader, offsets, "since")
+        if since is None or "deleted" not in offsets:
+            raise ValueError("not a delta backup")
+        if watermark is None or since > watermark:
+            raise ValueError("delta backup since >{}< doesn't continue >{}<"
+                             .format(since, watermark))
+        watermark = __watermark(reader, offsets, "until")
+
+
+def load_backup(backup, deltas=()):
+    """Replaces the database content with the backup in one transaction
+    and applies the delta backups on top of it, in the given order.
+
+    The upload is parsed incrementally: a first pass reads the version
+    number and the positions of the sections, the import then reads the
+    sections one by one, so only one batch of rows is held in memory.
+    Returns False if the backup was rejected or the import failed."""
     ca.logger.info("data import triggered")
-    content = backup.read()
-    data = json.loads(content)
-    # abort when the version numbers don't match
-    incoming_version = data["version_number"]
     local_version = get_version_number()
-    if incoming_version != local_version:
-        ca.logger("import aborted due to version error")
-        flash(_("Invalid version number"))
-        return redirect(url_for("administration.import_backup"))
+    documents = []
+    for file in [backup] + list(deltas):
+        reader = BackupReader(file)
+        try:
+            incoming_version, offsets = __read_index(reader, local_version)
+        except ValueError:
+            ca.logger.exception("import aborted due to an invalid backup file")
+            flash(_("Invalid backup file"))
+            return False
+        # abort when the version numbers don't match
+        if incoming_version != local_version:
+            ca.logger.error("import aborted due to version error")
+            flash(_("Invalid version number"))
+            return False
+        documents.append((reader, offsets))
+    try:
+        __check_chain(documents[0], documents[1:])
+    except ValueError:
+        ca.logger.exception("import aborted due to an invalid backup chain")
+        flash(_("The delta backups don't continue the backup"))
+        return False
 
-    # step 1: delete all entries without incoming dependencies
-    ca.logger.info("start deletion of database entries before import")
-    __handle_posts()
-    __handle_items()
-    __handle_notifications()
-    __handle_invoices()
-    __handle_registrations()
-    __handle_transfers()
-    __handle_chronicles()
+    return __in_transaction(
+        lambda backend: __do_import(backend, *documents[0], documents[1:]))
 
-    # step 2: delete everything that is now deleteable without violation
-    __handle_pkus()
-    __handle_festivals()
 
-    # finally: delete all users accept the owner
-    __handle_users()
+def __archive_section(archive, toc, key):
+    with archive.open(toc["tables"][key]["file"]) as member, \
+            gzip.open(member, "rt", encoding="utf-8") as lines:
+        for line in lines:
+            yield json.loads(line)
 
-    # now read the data from the file and write it to database
-    __do_import(data)
+
+def __read_toc(archive):
+    try:
+        with ZipFile(archive) as zip_file:
+            return json.loads(zip_file.read(ARCHIVE_TOC))
+    except (BadZipFile, KeyError, ValueError):
+        ca.logger.exception("archive has no table of contents")
+        return None
+
+
+def load_archive(archive, tables=None):
+    """Restores a backup archive written by stream_archive.
+
+    Without tables the database content is replaced like by load_backup.
+    Otherwise only the given sections are read: their rows are updated or
+    inserted and the other tables stay untouched. Each section is
+    decompressed line by line. Returns False if the archive was rejected
+    or the import failed."""
+    ca.logger.info("archive import triggered")
+    toc = __read_toc(archive)
+    if toc is None or toc.get("format") != ARCHIVE_FORMAT:
+        flash(_("Invalid backup file"))
+        return False
+    if toc["version_number"] != get_version_number():
+        ca.logger.error("import aborted due to version error")
+        flash(_("Invalid version number"))
+        return False
+
+    def do_import(backend):
+        with ZipFile(archive) as zip_file:
+            def section(key):
+                if tables is not None and key not in tables:
+                    return iter(())
+                return __archive_section(zip_file, toc, key)
+
+            owner = __owner()
+            if tables is None:
+                __delete_from_database(owner.id)
+            __import_sections(backend, section, owner, upsert=tables is not None)
+            __reset_id_counters(backend)
+
+    return __in_transaction(do_import)
+
+
+def load_archive_images(archive):
+    """Restores the chronicle images of a backup archive. Images which
+    already exist with the same content are kept, the hash of every
+    extracted image is checked against the manifest."""
+    photos = os.path.realpath(Config.UPLOAD_PATH)
+    restored = set()
+    with ZipFile(archive) as zip_file:
+        toc = json.loads(zip_file.read(ARCHIVE_TOC))
+        for image in json.loads(zip_file.read(toc["images"])):
+            path = os.path.realpath(os.path.join(photos, image["path"]))
+            if not path.startswith(photos + os.sep):
+                ca.logger.error("skipped image >{}< outside of the upload path"
+                                .format(image["path"]))
+                continue
+            restored.add(path)
+            if os.path.exists(path) and file_hash(path) == image["sha256"]:
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            digest = sha256()
+            with zip_file.open(image["file"]) as source, open(path + ".part", "wb") as target:
+                for block in iter(lambda: source.read(64 * 1024), b""):
+                    digest.update(block)
+                    target.write(block)
+            if digest.hexdigest() != image["sha256"]:
+                ca.logger.error("image >{}< is damaged".format(image["path"]))
+                os.remove(path + ".part")
+                continue
+            os.replace(path + ".part", path)
+
+    __remove_other_images(photos, restored)
+    image_store.rebuild()
+    avatars.invalidate()
 
 
 def load_images(images):
     if images:
-        __delete_chronicle_images()
-        __import_archive(images)
+        with ZipFile(images, "r") as zip_file:
+            if IMAGE_MANIFEST in zip_file.namelist():
+                __restore_image_objects(zip_file)
+            else:
+                # archives without manifest contain all images
+                __delete_chronicle_images()
+                zip_file.extractall(Config.UPLOAD_PATH)
+        image_store.rebuild()
+        avatars.invalidate()
     else:
         pass
 
 
+def __open_image_source(zip_file, members, local, photos, digest):
+    if digest in members:
+        return zip_file.open(members[digest])
+    if digest in local:
+        return open(os.path.join(photos, local[digest]["paths"][0]), "rb")
+    return None
+
+
+def __restore_image_objects(zip_file):
+    """Writes every hash of the manifest to its paths. Hashes which are not
+    in the archive were packaged by an earlier backup and are copied from
+    the local images."""
+    manifest = json.loads(zip_file.read(IMAGE_MANIFEST))
+    members = {os.path.splitext(os.path.basename(name))[0]: name
+               for name in zip_file.namelist() if name.startswith(IMAGE_OBJECT_DIR)}
+    local = image_store.snapshot()[1]
+    photos = os.path.realpath(Config.UPLOAD_PATH)
+
+    # the local copies are read before any image is replaced
+    restored = set()
+    written = []
+    for digest, paths in manifest["objects"].items():
+        targets = []
+        for path in paths:
+            target = os.path.realpath(os.path.join(photos, path))
+            if not target.startswith(photos + os.sep):
+                continue
+            restored.add(target)
+            if digest not in local or path not in local[digest]["paths"]:
+                targets.append(target)
+        if not targets:
+            continue
+        source = __open_image_source(zip_file, members, local, photos, digest)
+        if source is None:
+            ca.logger.error("image >{}< is neither in the archive nor local".format(digest))
+            continue
+        with source:
+            for target in targets:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                source.seek(0)
+                with open(target + ".part", "wb") as file:
+                    shutil.copyfileobj(source, file)
+                written.append(target)
+    for target in written:
+        os.replace(target + ".part", target)
+    __remove_other_images(photos, restored)
+
+
+def __remove_other_images(photos, kept):
+    for root, directories, files in os.walk(photos):
+        for filename in files:
+            path = os.path.join(root, filename)
+            if path not in kept \
+                    and os.path.splitext(filename)[1].lower() in Config.UPLOAD_EXTENSIONS:
+                os.remove(path)
+
+
 def __delete_chronicle_images():
     photos = Config.UPLOAD_PATH
     try:
         shutil.rmtree(photos)
     except OSError as e:
         print("Error: %s : %s" % (photos, e.strerror))
-
-
-def __import_archive(archive):
-    photos = Config.UPLOAD_PATH
-    with ZipFile(archive, "r") as zip_file:
-        zip_file.extractall(photos)
-
-
-def __reset_sequence(sequence, value):
-    ca.logger.info("Reset sequence >{}< to value >{}<".format(sequence, value))
-    session.execute(
-        "ALTER SEQUENCE {} RESTART WITH {}".format(sequence, value))
-
-
-def __import_users(users):
-    owner = session.query(m.User).filter_by(access_level=UserAccessLevel.OWNER).first()
-    max_id = 1
-    for u in users:
-        next_id = u["id"]
-        if next_id > max_id:
-            max_id = next_id
-        if u["access_level"] == owner.access_level:
-            # DO NOT OVERRIDE THE PASSWORD!
-            owner.username = u["username"]
-            owner.registration_code = u["registration_code"]
-            owner.about_me = u["about_me"]
-            owner.last_seen = u["last_seen"]
-            owner.access_level = u["access_level"]
-            owner.is_suspended = u["is_suspended"]
-            owner.partner_id = u["partner"]
-            owner.beer_demand = u["beer_demand"]
-            owner.mixed_demand = u["mixed_demand"]
-            owner.water_demand = u["water_demand"]
-        else:
-            user = m.User()
-            user.id = next_id
-            user.username = u["username"]
-            user.registration_code = u["registration_code"]
-            user.password_hash = u["password_hash"]
-            user.about_me = u["about_me"]
-            user.last_seen = u["last_seen"]
-            user.access_level = u["access_level"]
-            user.is_suspended = u["is_suspended"]
-            user.partner_id = u["partner"]
-            user.beer_demand = u["beer_demand"]
-            user.mixed_demand = u["mixed_demand"]
-            user.water_demand = u["water_demand"]
-            user.reset_code = u["reset_code"]
-            session.add(user)
-    __reset_sequence("user_id_seq", max_id + 1)
-    session.commit()
-
-
-def __import_festivals(festivals):
-    max_id = 1
-    for f in festivals:
-        next_id = f["id"]
-        if next_id > max_id:
-            max_id = next_id
-        festival = m.Festival()
-        festival.id = next_id
-        festival.title = f["title"]
-        festival.info = f["info"]
-        festival.creator_id = f["creator"]
-        festival.is_closed = f["is_closed"]
-        festival.update_info = f["update_info"]
-        festival.modified = f["modified"]
-        festival.end_date = f["end_date"]
-        festival.start_date = f["start_date"]
-        session.add(festival)
-        participants = f["participants"]
-        for p in participants:
-            u = session.query(m.User).get(p)
-            festival.join(u)
-    __reset_sequence("festival_id_seq", max_id + 1)
-    session.commit()
-
-
-def __import_pkus(pkus):
-    max_id = 1
-    for p in pkus:
-        next_id = p["id"]
-        if next_id > max_id:
-            max_id = next_id
-        pku = m.PackagingUnitType()
-        pku.id = next_id
-        pku.name = p["name"]
-        pku.abbreviation = p["abbreviation"]
-        pku.internal_name = p["internal_name"]
-        pku.delete = p["delete"]
-        session.add(pku)
-    __reset_sequence("packaging_unit_type_id_seq", max_id + 1)
-    session.commit()
-
-
-def __import_posts(posts):
-    parents = filter(lambda x: x["parent"] is None, posts)
-    children = filter(lambda x: x["parent"] is not None, posts)
-    max_id = __import_subset(parents, 1)
-    session.commit()
-    max_id = __import_subset(children, max_id)
-    __reset_sequence("post_id_seq", max_id + 1)
-    session.commit()
-
-
-def __import_subset(posts, max_id):
-    for p in posts:
-        next_id = p["id"]
-        if next_id > max_id:
-            max_id = next_id
-        post = m.Post()
-        post.id = next_id
-        post.body = p["body"]
-        post.timestamp = p["timestamp"]
-        post.user_id = p["author"]
-        post.is_pinned = p["is_pinned"]
-        post.parent_id = p["parent"]
-        post.internal_time = p["internal_time"]
-        session.add(post)
-    return max_id
-
-
-def __import_items(c_items, u_items):
-    max_id = 1
-    for c in c_items:
-        next_id = c["id"]
-        if next_id > max_id:
-            max_id = next_id
-        c_item = m.ConsumptionItem()
-        c_item.id = next_id
-        c_item.name = c["name"]
-        c_item.state = c["state"]
-        c_item.amount = c["amount"]
-        c_item.requestor_id = c["requestor"]
-        c_item.pku_id = c["pku"]
-        c_item.info = c["info"]
-        session.add(c_item)
-    __reset_sequence("consumption_item_id_seq", max_id + 1)
-    session.commit()
-    max_id = 1
-    for u in u_items:
-        next_id = u["id"]
-        if next_id > max_id:
-            max_id = next_id
-        u_item = m.UtilityItem()
-        u_item.id = next_id
-        u_item.name = u["name"]
-        u_item.owner_id = u["owner"]
-        u_item.description = u["description"]
-        session.add(u_item)
-    __reset_sequence("utility_item_id_seq", max_id + 1)
-    session.commit()
-
-
-def __import_invoices(invoices):
-    max_id = 1
-    for i in invoices:
-        next_id = i["id"]
-        if next_id > max_id:
-            max_id = next_id
-        invoice = m.Invoice()
-        invoice.id = i["id"]
-        invoice.title = i["title"]
-        invoice.amount = i["amount"]
-        invoice.creditor_id = i["creditor"]
-        invoice.festival_id = i["festival"]
-        session.add(invoice)
-        sharers = i["sharers"]
-        for s in sharers:
-            u = session.query(m.User).get(s)
-            invoice.add_sharer(u)
-    __reset_sequence("invoice_id_seq", max_id + 1)
-    session.commit()
-
-
-def __import_transfers(transfers):
-    max_id = 1
-    for t in transfers:
-        next_id = t["id"]
-        if next_id > max_id:
-            max_id = next_id
-        transfer = m.Transfer()
-        transfer.id = next_id
-        transfer.festival_id = t["festival"]
-        transfer.recipient_id = t["recipient"]
-        transfer.payer_id = t["payer"]
-        transfer.amount = t["amount"]
-        session.add(transfer)
-    __reset_sequence("transfer_id_seq", max_id + 1)
-    session.commit()
-    
-    
-def __import_chronicles(chronicles):
-    max_id = 1
-    for c in chronicles:
-        next_id = c["id"]
-        if next_id > max_id:
-            max_id = next_id
-        entry = m.ChronicleEntry()
-        entry.id = next_id
-        entry.body = c["body"]
-        entry.chronicler_id = c["chronicler"]
-        entry.festival_id = c["festival"]
-        entry.internal_time = c["internal_time"]
-        entry.timestamp = c["timestamp"]
-        entry.year = c["year"]
-        session.add(entry)
-    __reset_sequence("chronicle_entry_id_seq", max_id + 1)
-    session.commit()
-
-
-def __do_import(data):
-    ca.logger.info("start importing data from file")
-    __import_users(data["users"])
-    __import_festivals(data["festivals"])
-    __import_pkus(data["packagingUnits"])
-    __import_posts(data["posts"])
-    __import_items(data["consumptionItems"], data["utilityItems"])
-    __import_invoices(data["invoices"])
-    __import_transfers(data["transfers"])
-    __import_chronicles(data["chronicle"])
-    ca.logger.info("import finished")
@@ -0,0 +1,146 @@
+import codecs
+import json
+
+READ_SIZE = 64 * 1024
+# largest single value (e.g. one row) the reader accepts, in characters
+MAX_VALUE_SIZE = 64 * 1024 * 1024
+NUMBER_CHARS = "0123456789.eE+-"
+# errors this close to the end of the buffer may be caused by a token
+# which was cut off, e.g. "tru" or "\u00"
+TRUNCATION_MARGIN = 6
+
+
+class BackupReader(object):
+    """Incremental reader for a JSON document whose top level is an object.
+
+    Only the value at the current position is decoded, arrays are
+    returned element by element, so the memory needed does not depend on
+    the size of the document. The reader works on a binary file and can
+    jump back to the byte offsets returned by tell(). Malformed documents
+    and values larger than max_value_size raise a ValueError as soon as
+    they are detected.
+    """
+
+    def __init__(self, file, read_size=READ_SIZE, max_value_size=MAX_VALUE_SIZE):
+        self.file = file
+        self.read_size = read_size
+        self.max_value_size = max_value_size
+        self._decoder = json.JSONDecoder()
+        self.seek(0)
+
+    def seek(self, offset):
+        self.file.seek(offset)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._offset = offset
+        self._eof = False
+
+    def tell(self):
+        self.__skip_whitespace()
+        return self._offset + len(self._buffer[:self._pos].encode("utf-8"))
+
+    def members(self):
+        """Yields the keys of the object at the current position. The
+        caller has to consume each value with value(), items() or skip()
+        before asking for the next key."""
+        self.__expect("{")
+        if self.__peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError("object key expected at {}".format(self.tell()))
+            self.__expect(":")
+            yield key
+            if self.__next_separator("}"):
+                return
+
+    def items(self):
+        """Yields the elements of the array at the current position"""
+        self.__expect("[")
+        if self.__peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.__next_separator("]"):
+                return
+
+    def value(self):
+        self.__skip_whitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                if self._eof or not self.__truncated(e):
+                    raise
+            else:
+                # a number at the end of the buffer might continue
+                if self._eof or not self.__at_end(end):
+                    self._pos = end
+                    return value
+            pending = len(self._buffer) - self._pos
+            if pending > self.max_value_size:
+                raise ValueError("value at {} exceeds {} characters"
+                                 .format(self.tell(), self.max_value_size))
+            # read at least as much as is pending, so a large value is
+            # decoded a logarithmic number of times instead of once per read
+            self.__fill(pending)
+
+    def skip(self):
+        if self.__peek() == "[":
+            for _ in self.items():
+                pass
+        else:
+            self.value()
+
+    def __fill(self, size=0):
+        if self._pos > self.read_size:
+            # drop everything which was already decoded
+            consumed = self._buffer[:self._pos]
+            self._offset += len(consumed.encode("utf-8"))
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        data = self.file.read(max(size, self.read_size))
+        self._eof = not data
+        self._buffer += self._utf8.decode(data, final=self._eof)
+
+    def __truncated(self, error):
+        if error.msg.startswith("Unterminated string"):
+            return True
+        return error.pos >= len(self._buffer) - TRUNCATION_MARGIN
+
+    def __at_end(self, pos):
+        while pos < len(self._buffer) and self._buffer[pos] in NUMBER_CHARS:
+            pos += 1
+        return pos == len(self._buffer)
+
+    def __skip_whitespace(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buffer) or self._eof:
+                return
+            self.__fill()
+
+    def __peek(self):
+        self.__skip_whitespace()
+        if self._pos >= len(self._buffer):
+            raise ValueError("unexpected end of the document")
+        return self._buffer[self._pos]
+
+    def __expect(self, char):
+        if self.__peek() != char:
+            raise ValueError("'{}' expected at {}".format(char, self.tell()))
+        self._pos += 1
+
+    def __next_separator(self, closing):
+        char = self.__peek()
+        self._pos += 1
+        if char == closing:
+            return True
+        if char != ",":
+            raise ValueError("',' or '{}' expected".format(closing))
+        return False
@@ -1,7 +1,8 @@
 from flask_babel import lazy_gettext as _l
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
-from wtforms import IntegerField, SubmitField, PasswordField
+from wtforms import IntegerField, MultipleFileField, SelectMultipleField, \
+    SubmitField, PasswordField
 from wtforms.validators import NumberRange, DataRequired
 
 from app import archives, backups
@@ -18,7 +19,21 @@ class CreateRegistrationCodeForm(FlaskForm):
 class ImportBackupForm(FlaskForm):
     backup = FileField(_l("Backup file"), validators=[
         DataRequired(),
-        FileAllowed(backups, _l("Backup must be a JSON file!"))
+        FileAllowed(backups, _l("Backup must be a JSON file or an archive!"))
+    ])
+    deltas = MultipleFileField(_l("Delta backups"))
+    # only used for archives, nothing selected restores everything
+    tables = SelectMultipleField(_l("Restore only"), choices=[
+        ("users", _l("Users")),
+        ("festivals", _l("Festivals")),
+        ("invoices", _l("Invoices")),
+        ("transfers", _l("Transfers")),
+        ("posts", _l("Posts")),
+        ("chronicle", _l("Chronicle")),
+        ("consumptionItems", _l("Consumption items")),
+        ("packagingUnits", _l("Packaging units")),
+        ("utilityItems", _l("Utility items")),
+        ("images", _l("Images"))
     ])
     password = PasswordField(_l("Password"), validators=[
         DataRequired()
@@ -0,0 +1,133 @@
+from datetime import timezone
+
+from flask import current_app as ca
+from sqlalchemy import Date, DateTime, text
+from sqlalchemy.exc import OperationalError
+from werkzeug.http import parse_date
+
+# number of rows written by a single INSERT statement
+IMPORT_BATCH_SIZE = 500
+
+
+def __parse_datetime(value):
+    # the export writes datetimes as HTTP dates, the columns are naive UTC
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError("invalid date >{}<".format(value))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def __parse_date(value):
+    return __parse_datetime(value).date()
+
+
+def __converters(table):
+    converters = {}
+    for column in table.columns:
+        if isinstance(column.type, DateTime):
+            converters[column.name] = __parse_datetime
+        elif isinstance(column.type, Date):
+            converters[column.name] = __parse_date
+    return converters
+
+
+def convert_rows(table, rows):
+    """Turns date strings from the backup into the column's python type,
+    which every dialect accepts"""
+    converters = __converters(table)
+    if not converters:
+        return rows
+    for row in rows:
+        for name, convert in converters.items():
+            if isinstance(row.get(name), str):
+                row[name] = convert(row[name])
+    return rows
+
+
+class ImportBackend(object):
+    """Writes the rows of a backup import; PostgreSQL and generic dialects"""
+
+    def __init__(self, session):
+        self.session = session
+
+    def begin(self):
+        pass
+
+    def end(self):
+        pass
+
+    def insert(self, table, rows):
+        rows = convert_rows(table, rows)
+        for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+            self.session.execute(table.insert().values(rows[start:start + IMPORT_BATCH_SIZE]))
+
+    def reset_id_counter(self, table, value):
+        """Lets the next generated id of the table be value"""
+        ca.logger.info("Reset id counter of >{}< to value >{}<".format(table.name, value))
+        self.session.execute(
+            text("SELECT setval(pg_get_serial_sequence(:table, 'id'), :value, false)"),
+            {"table": '"{}"'.format(table.name), "value": value})
+
+
+class SQLiteImportBackend(ImportBackend):
+    """Uses executemany for the inserts and relaxes the durability
+    settings for the duration of the import"""
+
+    pragmas = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL"
+    }
+
+    def __init__(self, session):
+        super(SQLiteImportBackend, self).__init__(session)
+        self._previous = {}
+
+    def begin(self):
+        for name, value in self.pragmas.items():
+            try:
+                self._previous[name] = self.__pragma(name)
+                self.__pragma(name, value)
+            except OperationalError:
+                # journal_mode can't be changed inside a running transaction
+                ca.logger.warning("could not set PRAGMA >{}< for the import".format(name))
+        # foreign keys are checked once at commit
+        self.__pragma("defer_foreign_keys", "ON")
+
+    def end(self):
+        for name, value in self._previous.items():
+            try:
+                self.__pragma(name, value)
+            except OperationalError:
+                ca.logger.warning("could not reset PRAGMA >{}< after the import".format(name))
+        self._previous = {}
+
+    def insert(self, table, rows):
+        if rows:
+            self.session.execute(table.insert(), convert_rows(table, rows))
+
+    def reset_id_counter(self, table, value):
+        # without AUTOINCREMENT sqlite continues after the highest rowid,
+        # only tables listed in sqlite_sequence keep their own counter
+        has_sequence = self.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_sequence'")).scalar()
+        if has_sequence:
+            ca.logger.info("Reset id counter of >{}< to value >{}<".format(table.name, value))
+            self.session.execute(text("UPDATE sqlite_sequence SET seq = :seq WHERE name = :table"),
+                                 {"seq": value - 1, "table": table.name})
+
+    def __pragma(self, name, value=None):
+        if value is None:
+            return self.session.execute(text("PRAGMA {}".format(name))).scalar()
+        self.session.execute(text("PRAGMA {} = {}".format(name, value)))
+
+
+backends = {
+    "sqlite": SQLiteImportBackend
+}
+
+
+def backend_for(session):
+    dialect = session.connection().dialect.name
+    return backends.get(dialect, ImportBackend)(session)
@@ -1,22 +1,28 @@
+from datetime import datetime
+from zipfile import is_zipfile
+
 from flask import abort
 from flask import current_app as ca
-from flask import flash, redirect, render_template, request, url_for
+from flask import flash, jsonify, redirect, render_template, request, url_for
 from flask_babel import _
 from flask_login import current_user, login_required
 
 import app.models as m
-from app import session
+from app import query_stats, session
 from app.administration import bp
 from app.administration.forms import CreateRegistrationCodeForm, \
     ImportBackupForm
 from app.administration.user_administration import disable_user
-from app.administration.backup_export import prepare_export, zip_and_download_images
-from app.administration.backup_import import load_backup, load_images
+from app.administration.backup_export import prepare_delta_export, \
+    prepare_export, stream_archive, stream_export, zip_and_download_images
+from app.administration.backup_import import load_archive, \
+    load_archive_images, load_backup, load_images
 from app.administration.messages import (suspend_first, suspended,
                                          suspension_failed)
 from app.containers import UserAccessLevel
 from app.logic import notify_owner, notify_user, random_string
 from app.main.utils import not_heroku
+from app.uploads import upload_limit
 from config import is_heroku
 
 
@@ -224,6 +230,17 @@ def delete_user(username):
 @login_required
 def create_backup():
     if current_user.is_owner():
+        since = request.args.get("since")
+        if since is not None:
+            try:
+                since = datetime.fromisoformat(since)
+            except ValueError:
+                abort(400)
+            return prepare_delta_export(since)
+        if request.args.get("format") == "archive":
+            return stream_archive()
+        if request.args.get("stream", 1, type=int):
+            return stream_export()
         return prepare_export()
     else:
         ca.logger.warn(">{}< was prevented entering backup page"
@@ -236,7 +253,7 @@ def create_backup():
 @not_heroku
 def backup_images():
     if current_user.is_owner():
-        return zip_and_download_images()
+        return zip_and_download_images(request.args.get("since", 0, type=int))
     else:
         ca.logger.warn(">{}< was prevented entering backup page"
                        .format(current_user.username))
@@ -244,6 +261,7 @@ def backup_images():
 
 
 @bp.route("/import_backup", methods=["GET", "POST"])
+@upload_limit("MAX_BACKUP_LENGTH")
 @login_required
 def import_backup():
     if current_user.is_owner():
@@ -252,9 +270,19 @@ def import_backup():
             if not current_user.check_password(form.password.data):
                 flash(_("Invalid password"))
                 return redirect(url_for("administration.import_backup"))
-            load_backup(request.files["backup"])
-            load_images(request.files["images"])
-            flash(_("Import finished"))
+            backup = request.files["backup"]
+            if is_zipfile(backup):
+                tables = set(form.tables.data) or None
+                if load_archive(backup, tables):
+                    if not is_heroku() and (tables is None or "images" in tables):
+                        load_archive_images(backup)
+                    flash(_("Import finished"))
+            else:
+                backup.seek(0)
+                deltas = [f for f in request.files.getlist("deltas") if f.filename]
+                if load_backup(backup, deltas):
+                    load_images(request.files["images"])
+                    flash(_("Import finished"))
         return render_template("add_form.html",
                                title=_("Import backup"),
                                form=form)
@@ -262,3 +290,15 @@ def import_backup():
         ca.logger.warn(">{}< was prevented from importing backup"
                        .format(current_user.username))
         abort(403)
+
+
+@bp.route("/query_stats")
+@login_required
+def show_query_stats():
+    if current_user.is_owner():
+        limit = request.args.get("limit", 20, type=int)
+        return jsonify(query_stats.slowest(limit))
+    else:
+        ca.logger.warn(">{}< was prevented from loading query statistics"
+                       .format(current_user.username))
+        abort(403)
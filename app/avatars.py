@@ -0,0 +1,75 @@
+import os
+from threading import Lock
+
+
+class AvatarIndex(object):
+    """Maps registration codes to the static path of the uploaded photo.
+
+    The photo directory is scanned once and the result is kept in memory,
+    so rendering an avatar no longer needs a glob() per call. The index
+    rebuilds itself when the directory's mtime changes, which keeps it in
+    sync with uploads handled by other worker processes.
+    """
+
+    def __init__(self, app=None):
+        self.photo_path = None
+        self.scans = 0
+        self._paths = None
+        self._mtime = None
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.photo_path = app.config["UPLOADED_PHOTOS_DEST"]
+        self.invalidate()
+        self.build()
+
+    def build(self):
+        paths = {}
+        mtime = self.__directory_mtime()
+        if mtime is not None:
+            with os.scandir(self.photo_path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        code = os.path.splitext(entry.name)[0]
+                        paths[code] = self.__static_path(entry.path)
+        self.scans += 1
+        self._paths = paths
+        self._mtime = mtime
+        return paths
+
+    def lookup(self, registration_code):
+        paths = self._paths
+        if paths is None or self.__directory_mtime() != self._mtime:
+            with self._lock:
+                paths = self.build()
+        return paths.get(registration_code)
+
+    def update(self, registration_code, file_path):
+        with self._lock:
+            if self._paths is not None:
+                self._paths[registration_code] = self.__static_path(file_path)
+                self._mtime = self.__directory_mtime()
+
+    def remove(self, registration_code):
+        with self._lock:
+            if self._paths is not None:
+                self._paths.pop(registration_code, None)
+                self._mtime = self.__directory_mtime()
+
+    def invalidate(self):
+        with self._lock:
+            self._paths = None
+            self._mtime = None
+
+    def __directory_mtime(self):
+        try:
+            return os.stat(self.photo_path).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    @staticmethod
+    def __static_path(file_path):
+        split = file_path.split(sep=os.path.sep)
+        return "/%s/%s/%s" % (split[-3], split[-2], split[-1])
@@ -8,7 +8,7 @@ from flask_babel import _
 from flask_login import login_required, current_user as cu
 from werkzeug.utils import secure_filename
 
-from app import session
+from app import image_store, session
 from app.chronicle import bp
 from app.chronicle.forms import ChronicleEntryForm
 from app.chronicle.logic import get_festival_selection, get_images
@@ -82,6 +82,7 @@ def upload_images(f_id):
 
         file_path = os.path.join(ca.config["UPLOAD_PATH"], "{}/{}/{}".format(f_id, cu.id, filename))
         uploaded_file.save(file_path)
+        image_store.add(file_path)
 
     return "", 200
 
@@ -150,6 +151,7 @@ def delete_entry(entry_id):
         path = os.path.join(ca.config["UPLOAD_PATH"], "{}/{}".format(f_id, u_id))
         if os.path.exists(path):
             shutil.rmtree(path)
+            image_store.remove(path)
 
         session.delete(entry)
         session.commit()
@@ -176,4 +178,5 @@ def delete_image():
     if os.path.exists(path):
         ca.logger.info("Delete file >{}<".format(path))
         os.remove(path)
+        image_store.remove(path)
     return "", 200
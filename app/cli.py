@@ -7,10 +7,11 @@ import click
 from sqlalchemy.engine.reflection import Inspector
 from sqlalchemy.schema import DropConstraint, DropTable, MetaData, Table
 
-from app import db, session
+from app import avatars as avatar_index, db, session
 from app.containers import UserAccessLevel
 from app.logic import create_user, create_festival, create_pku
 from app.models import User, PackagingUnitType
+from app.purchase.planning import format_mix, plan_drinks
 from config import Config
 
 
@@ -111,6 +112,20 @@ def register(app):
             print("Found {} user(s) in database. Skipped testdata creation"
                   .format(len(users)))
 
+    @app.cli.group()
+    def purchase():
+        """Shopping list helpers"""
+        pass
+
+    @purchase.command()
+    def plan():
+        """Plans the drinks of every open festival"""
+        for p in plan_drinks().values():
+            print("{} ({} days)".format(p.demand.title, p.demand.days))
+            print("  Beer:  {} cans {}".format(p.beer, format_mix(p.beer_packages)))
+            print("  Mixed: {} cans {}".format(p.mixed, format_mix(p.mixed_packages)))
+            print("  Water: {} sixpacks".format(p.water))
+
     @app.cli.group()
     def postgres():
         """Collection of helpers for managing the database"""
@@ -148,6 +163,7 @@ def register(app):
             shutil.rmtree(avatars)
         except OSError as e:
             print("Error: %s : %s" % (avatars, e.strerror))
+        avatar_index.invalidate()
         print("Delete chronicle photos")
         photos = Config.UPLOAD_PATH
         try:
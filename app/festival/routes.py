@@ -4,7 +4,7 @@ from flask_babel import _
 from flask_login import current_user, login_required
 
 from app import session
-from app.logic import notify_users
+from app.logic import invalidate_festival_references, schedule_notify_users
 from app.festival import bp
 from app.festival.forms import FestivalForm, InvoiceForm, EditInvoiceForm
 from app.festival.logic import get_participants, \
@@ -25,7 +25,7 @@ def join_festival(title):
     invoices = festival.invoices.all()
     for p in invoices:
         p.add_sharer(current_user)
-    notify_users()
+    schedule_notify_users()
     ca.logger.info(">{}< has joined >{}<"
                    .format(current_user.username, festival.title))
     flash(_("Welcome at %(title)s!", title=title))
@@ -43,7 +43,7 @@ def leave_festival(title):
     invoices = festival.invoices.all()
     for p in invoices:
         p.remove_sharer(current_user)
-    notify_users()
+    schedule_notify_users()
     ca.logger.info(">{}< has left >{}<"
                    .format(current_user.username, festival.title))
     flash(_("You have left %(title)s.", title=title))
@@ -104,7 +104,8 @@ def create_festival():
                                 end_date=form.end_date.data,
                                 is_closed=False)
             session.add(festival)
-            notify_users()
+            schedule_notify_users()
+            invalidate_festival_references()
             flash(_("Festival has been created."))
             ca.logger.info(">{}< has entered festival page of >{}<"
                            .format(current_user.username, festival.title))
@@ -130,7 +131,8 @@ def edit_festival(festival_id):
             festival.start_date = form.start_date.data
             festival.end_date = form.end_date.data
             festival.update_info = FestivalUpdateInfo.festival_md_updated
-            notify_users()
+            schedule_notify_users()
+            invalidate_festival_references()
             flash(_("Your changes have been saved."))
             ca.logger.info(">{}< has entered festival page of >{}<"
                            .format(current_user.username, festival.title))
@@ -155,7 +157,8 @@ def edit_festival(festival_id):
 def close_festival(title):
     festival = session.query(Festival).filter_by(title=title).first_or_404()
     close(festival)
-    notify_users()
+    schedule_notify_users()
+    invalidate_festival_references()
     flash(_("Festival has been closed."))
     ca.logger.info(">{}< has closed >{}<"
                    .format(current_user.username, festival.title))
@@ -167,7 +170,8 @@ def close_festival(title):
 def reopen_festival(title):
     festival = session.query(Festival).filter_by(title=title).first_or_404()
     reopen(festival)
-    notify_users()
+    schedule_notify_users()
+    invalidate_festival_references()
     flash(_("Festival has been reopened."))
     ca.logger.info(">{}< has reopened >{}<"
                    .format(current_user.username, festival.title))
@@ -209,7 +213,7 @@ def add_invoice(title):
         for user in sharers:
             invoice.add_sharer(user)
 
-        notify_users()
+        schedule_notify_users()
         flash(_("Your invoice has been registered."))
         ca.logger.info(">{}< has added invoice to >{}<"
                        .format(current_user.username, festival.title))
@@ -231,7 +235,7 @@ def edit_invoice(f_title, p_title):
         sharer_ids = form.sharers.data
         invoice.set_sharers(sharer_ids)
         festival.update_info = FestivalUpdateInfo.invoice_updated
-        notify_users()
+        schedule_notify_users()
         ca.logger.info(">{}< has edited invoice >{}<"
                        .format(current_user.username, invoice.title))
         flash(_("Invoice has been updated."))
@@ -260,7 +264,7 @@ def delete_invoice(f_title, invoice_id):
     invoice = session.query(Invoice).get(invoice_id)
     session.delete(invoice)
     festival.update_info = FestivalUpdateInfo.invoice_deleted
-    notify_users()
+    schedule_notify_users()
     ca.logger.info(
         ">{}< has deleted invoice >{}< (amount: {})"
         .format(current_user.username, invoice.title, invoice.amount))
@@ -0,0 +1,133 @@
+import heapq
+from collections import namedtuple
+from types import MappingProxyType
+
+from app import session
+from app.models import Invoice, User, participants as prts, sharers as shrs
+
+
+class Ledger(namedtuple("Ledger", ["festival_id", "participants",
+                                   "balances", "partners"])):
+    """Immutable result of the share calculation of a festival.
+
+    balances maps user ids to their debt in cents (positive: has to pay,
+    negative: gets money back), partners maps participant ids to the
+    ids of their partners.
+    """
+    __slots__ = ()
+
+    def balance(self, user_id):
+        return self.balances.get(user_id, 0)
+
+    def payers(self):
+        return [p for p in self.participants if self.balance(p) > 0]
+
+    def receivers(self):
+        return [p for p in self.participants if self.balance(p) < 0]
+
+
+def load_ledger(festival_id):
+    """Calculates the festival's balances with three queries"""
+    participants = session.query(User.id, User.partner_id) \
+        .join(prts, prts.c.participant_id == User.id) \
+        .filter(prts.c.festival_id == festival_id) \
+        .order_by(User.id).all()
+    invoices = session.query(Invoice.id, Invoice.amount_cents, Invoice.creditor_id) \
+        .filter(Invoice.festival_id == festival_id).all()
+    sharer_rows = session.query(shrs.c.invoice_id, shrs.c.sharer_id) \
+        .join(Invoice, Invoice.id == shrs.c.invoice_id) \
+        .filter(Invoice.festival_id == festival_id).all()
+
+    sharers_by_invoice = {}
+    for invoice_id, sharer_id in sharer_rows:
+        sharers_by_invoice.setdefault(invoice_id, []).append(sharer_id)
+
+    balances = {p.id: 0 for p in participants}
+    for invoice_id, amount, creditor_id in invoices:
+        sharer_ids = sharers_by_invoice.get(invoice_id)
+        if not sharer_ids:
+            continue
+        # the remaining cents go to the first sharers, so the shares
+        # always add up to the invoice amount
+        share, remainder = divmod(amount, len(sharer_ids))
+        for i, s in enumerate(sorted(sharer_ids)):
+            balances[s] = balances.get(s, 0) + share + (i < remainder)
+        balances[creditor_id] = balances.get(creditor_id, 0) - amount
+
+    partners = {p.id: p.partner_id for p in participants
+                if p.partner_id is not None}
+    return Ledger(festival_id=festival_id,
+                  participants=tuple(p.id for p in participants),
+                  balances=MappingProxyType(balances),
+                  partners=MappingProxyType(partners))
+
+
+def __partner_of(ledger):
+    return {partner_id: user_id for user_id, partner_id in ledger.partners.items()}
+
+
+def settle_greedy(ledger):
+    """Matches the largest creditor with the largest debtor.
+
+    The receiver's partner pays first if they owe anything. Every transfer
+    settles at least one side completely, so there are at most
+    len(participants) - 1 transfers. Returns (payer, recipient, cents)
+    triples.
+    """
+    partner_of = __partner_of(ledger)
+    debts = {p: ledger.balance(p) for p in ledger.participants}
+    debtors = [(-c, p) for p, c in debts.items() if c > 0]
+    creditors = [(c, p) for p, c in debts.items() if c < 0]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    transfers = []
+    while debtors and creditors:
+        _, receiver = heapq.heappop(creditors)
+        payer = partner_of.get(receiver)
+        if payer is None or debts.get(payer, 0) <= 0:
+            # skip entries which were settled by a partner transfer
+            while debtors and debts[debtors[0][1]] != -debtors[0][0]:
+                heapq.heappop(debtors)
+            if not debtors:
+                break
+            payer = heapq.heappop(debtors)[1]
+        amount = min(debts[payer], -debts[receiver])
+        transfers.append((payer, receiver, amount))
+        debts[payer] -= amount
+        debts[receiver] += amount
+        if debts[payer] > 0:
+            heapq.heappush(debtors, (-debts[payer], payer))
+        if debts[receiver] < 0:
+            heapq.heappush(creditors, (debts[receiver], receiver))
+    return transfers
+
+
+def settle_legacy(ledger):
+    """The original algorithm: every receiver is refunded in participant
+    order, preferring their partner, then payers without a partner."""
+    partner_of = __partner_of(ledger)
+    debts = {p: ledger.balance(p) for p in ledger.participants}
+
+    transfers = []
+    for r in ledger.receivers():
+        not_refunded = -debts[r]
+        while not_refunded > 0:
+            payers = [p for p in ledger.participants if debts[p] > 0]
+            if not payers:
+                break
+            payer = partner_of.get(r)
+            if payer not in payers:
+                without_partner = [p for p in payers if p not in ledger.partners]
+                payer = (without_partner or payers)[0]
+            amount = min(debts[payer], not_refunded)
+            transfers.append((payer, r, amount))
+            debts[payer] -= amount
+            not_refunded -= amount
+    return transfers
+
+
+strategies = {
+    "greedy": settle_greedy,
+    "legacy": settle_legacy
+}
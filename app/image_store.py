@@ -0,0 +1,136 @@
+import json
+import os
+from contextlib import contextmanager
+from hashlib import sha256
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:  # Windows, only one process is supported there
+    fcntl = None
+
+READ_SIZE = 64 * 1024
+
+
+def file_hash(file_path):
+    digest = sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ImageStore(object):
+    """Content addressed manifest of the chronicle images.
+
+    Maps the sha256 of every image to the paths (relative to UPLOAD_PATH)
+    with that content. Each hash remembers the serial number of the upload
+    which added it, so an image backup only has to contain the hashes added
+    after the serial of the previous backup. The manifest is a JSON file in
+    the upload directory, rebuilt from the files if missing. Every change
+    reads and rewrites it while holding an exclusive flock on
+    manifest.json.lock, so worker processes don't lose each other's
+    entries.
+    """
+
+    def __init__(self, app=None):
+        self.upload_path = None
+        self.manifest_path = None
+        self.extensions = ()
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.upload_path = app.config["UPLOAD_PATH"]
+        self.manifest_path = os.path.join(self.upload_path, "manifest.json")
+        self.extensions = app.config["UPLOAD_EXTENSIONS"]
+
+    def add(self, file_path):
+        digest = file_hash(file_path)
+        path = self.__relative(file_path)
+        with self.__locked():
+            serial, objects = self.__load()
+            self.__drop(objects, path)
+            serial += 1
+            entry = objects.setdefault(digest, {"serial": serial, "paths": []})
+            entry["paths"].append(path)
+            self.__save(serial, objects)
+        return digest
+
+    def remove(self, file_path):
+        """Removes the file or all files below the directory file_path"""
+        path = self.__relative(file_path)
+        with self.__locked():
+            serial, objects = self.__load()
+            self.__drop(objects, path)
+            self.__save(serial, objects)
+
+    def snapshot(self):
+        """Returns the current serial and a copy of the manifest"""
+        with self.__locked():
+            return self.__load()
+
+    def rebuild(self):
+        """Hashes all images again, every hash gets a new serial"""
+        with self.__locked():
+            serial = self.__load()[0] + 1
+            self.__save(serial, self.__scan(serial))
+        return serial
+
+    @contextmanager
+    def __locked(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.upload_path, exist_ok=True)
+            with open(self.manifest_path + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __scan(self, serial):
+        objects = {}
+        for root, directories, files in os.walk(self.upload_path):
+            for filename in files:
+                if os.path.splitext(filename)[1].lower() not in self.extensions:
+                    continue
+                file_path = os.path.join(root, filename)
+                entry = objects.setdefault(file_hash(file_path),
+                                           {"serial": serial, "paths": []})
+                entry["paths"].append(self.__relative(file_path))
+        return objects
+
+    def __relative(self, file_path):
+        return os.path.relpath(file_path, self.upload_path).replace(os.sep, "/")
+
+    @staticmethod
+    def __drop(objects, path):
+        prefix = path.rstrip("/") + "/"
+        for digest in list(objects):
+            paths = [p for p in objects[digest]["paths"]
+                     if p != path and not p.startswith(prefix)]
+            if paths:
+                objects[digest]["paths"] = paths
+            else:
+                del objects[digest]
+
+    def __load(self):
+        try:
+            with open(self.manifest_path) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            objects = self.__scan(1)
+            self.__save(1, objects)
+            return 1, objects
+        return manifest["serial"], manifest["objects"]
+
+    def __save(self, serial, objects):
+        os.makedirs(self.upload_path, exist_ok=True)
+        temp_path = "{}.{}".format(self.manifest_path, os.getpid())
+        with open(temp_path, "w") as file:
+            json.dump({"serial": serial, "objects": objects}, file)
+        os.replace(temp_path, self.manifest_path)
@@ -0,0 +1,92 @@
+import time
+from threading import Lock
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+
+class QueryStats(object):
+    """Counts SQL statements and database time per request.
+
+    Enabled with SQL_INSTRUMENTATION. Statements slower than
+    SLOW_QUERY_THRESHOLD seconds are logged, each response gets a
+    Server-Timing header and the totals are aggregated per endpoint.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.threshold = 0.0
+        self._endpoints = {}
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self._endpoints = {}
+        if not app.config.get("SQL_INSTRUMENTATION"):
+            return
+        self.threshold = app.config.get("SLOW_QUERY_THRESHOLD", 0.5)
+
+        from app import db
+        engine = db.get_engine(app)
+        # init_app might run again for the same app and engine
+        if not event.contains(engine, "before_cursor_execute",
+                              self.__before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", self.__before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self.__after_cursor_execute)
+        if self.__after_request not in app.after_request_funcs.get(None, []):
+            app.before_request(self.__before_request)
+            app.after_request(self.__after_request)
+
+    def slowest(self, limit=20):
+        with self._lock:
+            endpoints = [{
+                "endpoint": endpoint,
+                "requests": stats[0],
+                "queries": stats[1],
+                "db_time_ms": round(stats[2] * 1000, 2),
+                "avg_queries": round(stats[1] / stats[0], 2),
+                "avg_db_time_ms": round(stats[2] * 1000 / stats[0], 2),
+                "max_db_time_ms": round(stats[3] * 1000, 2)
+            } for endpoint, stats in self._endpoints.items()]
+        endpoints.sort(key=lambda e: e["avg_db_time_ms"], reverse=True)
+        return endpoints[:limit]
+
+    @staticmethod
+    def __before_request():
+        g.sql_queries = 0
+        g.sql_time = 0.0
+
+    def __after_request(self, response):
+        queries = g.get("sql_queries", 0)
+        db_time = g.get("sql_time", 0.0)
+        response.headers.add("Server-Timing", 'db;dur={:.2f};desc="{} queries"'
+                             .format(db_time * 1000, queries))
+        endpoint = request.endpoint or request.path
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, [0, 0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += queries
+            stats[2] += db_time
+            stats[3] = max(stats[3], db_time)
+        return response
+
+    @staticmethod
+    def __before_cursor_execute(conn, cursor, statement, parameters,
+                                context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def __after_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        starts = conn.info.get("query_start")
+        if not starts:
+            # the listeners were attached while the statement was running
+            return
+        duration = time.perf_counter() - starts.pop()
+        if has_request_context():
+            g.sql_queries = g.get("sql_queries", 0) + 1
+            g.sql_time = g.get("sql_time", 0.0) + duration
+        if duration > self.threshold:
+            self.app.logger.warning("slow query ({:.3f}s): {}"
+                                    .format(duration, statement))
@@ -0,0 +1,86 @@
+import atexit
+import threading
+import time
+
+
+class JobQueue(object):
+    """Runs post-commit side effects on a background worker thread.
+
+    Jobs are coalesced by key: while a job is pending, enqueueing another
+    one with the same key only replaces its arguments, so a burst of edits
+    within JOB_QUEUE_DELAY seconds triggers a single run. In testing mode
+    (or with JOB_QUEUE_INLINE set) every job runs inline instead.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.inline = True
+        self.delay = 0.0
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._worker = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.inline = app.config.get("JOB_QUEUE_INLINE", app.testing)
+        self.delay = app.config.get("JOB_QUEUE_DELAY", 1.0)
+        if not self.inline and self._worker is None:
+            self._worker = threading.Thread(target=self.__work,
+                                            name="job-queue", daemon=True)
+            self._worker.start()
+            atexit.register(self.drain)
+
+    def enqueue(self, func, *args, key=None, delay=None, **kwargs):
+        """Runs func after delay seconds, JOB_QUEUE_DELAY by default"""
+        if self.inline:
+            func(*args, **kwargs)
+            return
+        if key is None:
+            key = (func, args)
+        with self._condition:
+            if key in self._pending:
+                self._pending[key][1:] = [func, args, kwargs]
+            else:
+                due = time.monotonic() + (self.delay if delay is None else delay)
+                self._pending[key] = [due, func, args, kwargs]
+                self._condition.notify()
+
+    def drain(self):
+        """Runs all pending jobs immediately, e.g. at shutdown."""
+        with self._condition:
+            jobs = list(self._pending.values())
+            self._pending.clear()
+        for job in jobs:
+            self.__run(job)
+
+    def __due_jobs(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                due = [k for k, job in self._pending.items() if job[0] <= now]
+                if due:
+                    return [self._pending.pop(k) for k in due]
+                timeout = None
+                if self._pending:
+                    timeout = min(job[0] for job in self._pending.values()) - now
+                self._condition.wait(timeout)
+
+    def __work(self):
+        while True:
+            for job in self.__due_jobs():
+                self.__run(job)
+
+    def __run(self, job):
+        _, func, args, kwargs = job
+        from app import db
+        with self.app.app_context():
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception(
+                    "background job >{}< failed".format(func.__name__))
+            finally:
+                db.session.remove()
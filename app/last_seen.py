@@ -0,0 +1,57 @@
+from threading import Lock
+
+from sqlalchemy import bindparam, or_
+
+
+class LastSeenBuffer(object):
+    """Collects last_seen timestamps in memory and writes them behind.
+
+    The first record() after a flush schedules the next flush on the job
+    queue, LAST_SEEN_FLUSH_INTERVAL seconds later. It writes all buffered
+    timestamps with one executemany UPDATE, and the job queue drains it at
+    shutdown. A timestamp never moves last_seen backwards, so buffers of
+    several worker processes can flush in any order.
+    """
+
+    def __init__(self, app=None):
+        self.interval = 0.0
+        self._pending = {}
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.interval = app.config.get("LAST_SEEN_FLUSH_INTERVAL", 30.0)
+        with self._lock:
+            self._pending = {}
+
+    def get(self, user_id, default=None):
+        """Returns the buffered timestamp of the user or default"""
+        return self._pending.get(user_id, default)
+
+    def record(self, user_id, timestamp):
+        from app import jobs
+        with self._lock:
+            previous = self._pending.get(user_id)
+            if previous is None or previous < timestamp:
+                self._pending[user_id] = timestamp
+        jobs.enqueue(self.flush, key=(LastSeenBuffer.flush,), delay=self.interval)
+
+    def flush(self):
+        from app import session
+        from app.models import User
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        users = User.__table__
+        session.execute(users.update().where(
+            users.c.id == bindparam("b_id"),
+            or_(users.c.last_seen == None,  # noqa: E711
+                users.c.last_seen < bindparam("b_last_seen"))
+        ).values(last_seen=bindparam("b_last_seen"),
+                 # a visit is no change for the delta backups
+                 updated_at=users.c.updated_at), [
+            {"b_id": user_id, "b_last_seen": last_seen}
+            for user_id, last_seen in pending.items()])
+        session.commit()
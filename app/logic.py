@@ -1,13 +1,18 @@
+import json
 import random
 import string
 import os
+from datetime import datetime
+from time import time
 
 from flask import abort
 from flask_login import current_user
+from sqlalchemy import func
 
-from app import session
+from app import jobs, last_seen_buffer, notification_hub, reference_cache, session
 from app.containers import NotificationType, UserAccessLevel
-from app.models import User, Festival, PackagingUnitType
+from app.models import User, Festival, Notification, PackagingUnitType
+from app.reference_cache import DRINK_CATALOG, FESTIVAL_SELECTION, PKU_SELECTION
 
 
 def random_string(length=8):
@@ -16,14 +21,54 @@ def random_string(length=8):
     return "".join(random.choice(letters) for i in range(length))
 
 
+def invalidate_pku_references():
+    reference_cache.invalidate(PKU_SELECTION, DRINK_CATALOG)
+
+
+def invalidate_festival_references():
+    reference_cache.invalidate(FESTIVAL_SELECTION)
+
+
 def notify_users(current_user_id=None,
                  notificationType=NotificationType.festival_updated):
     if current_user_id is None:
         current_user_id = current_user.id
-    users = session.query(User).filter(User.id != current_user_id).all()
-    for u in users:
-        u.add_notification(notificationType, u.new_activities())
+    # the counts are based on last_seen, which the buffer might not have
+    # written yet
+    last_seen_buffer.flush()
+    # one grouped query instead of User.new_activities() per user
+    last_visit_time = func.coalesce(User.last_seen, datetime(1900, 1, 1))
+    activities = session.query(User.id, func.count(Festival.id)) \
+        .outerjoin(Festival, Festival.modified > last_visit_time) \
+        .filter(User.id != current_user_id) \
+        .group_by(User.id).all()
+    session.query(Notification).filter(
+        Notification.name == notificationType,
+        Notification.user_id != current_user_id
+    ).delete(synchronize_session=False)
+    if activities:
+        timestamp = time()
+        session.execute(Notification.__table__.insert(), [{
+            "name": notificationType,
+            "user_id": user_id,
+            "payload_json": json.dumps(count),
+            "timestamp": timestamp
+        } for user_id, count in activities])
+        for user_id, count in activities:
+            notification_hub.publish_after_commit(session, user_id, {
+                "name": notificationType,
+                "data": count,
+                "timestamp": timestamp
+            })
+    session.commit()
+
+
+def schedule_notify_users(notificationType=NotificationType.festival_updated):
+    """Commits pending changes and defers the fan-out to the job queue"""
     session.commit()
+    current_user_id = current_user.id
+    jobs.enqueue(notify_users, current_user_id, notificationType,
+                 key=(notify_users, current_user_id, notificationType))
 
 
 def notify_user(user, notificationType=NotificationType.admin):
@@ -97,6 +142,7 @@ def create_pku():
         name="Cans",
         internal_name="Cans",
         delete=False,
+        package_sizes="24,18",
         abbreviation="cns"))
     session.add(PackagingUnitType(
         name="Sixpacks",
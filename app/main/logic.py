@@ -0,0 +1,88 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app as ca, g
+from flask_login import current_user
+from sqlalchemy import func, null, select
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import last_seen_buffer, session
+from app.containers import NotificationType
+from app.models import Festival, Notification, Post, Registration, User
+
+NavbarBadges = namedtuple("NavbarBadges", ["new_activities", "available_codes",
+                                           "access_level_changed"])
+
+
+def load_timeline(page):
+    """Loads a page of top-level posts together with their replies and
+    authors, using one query each instead of one per post.
+
+    Returns the pagination object and a dict mapping post ids to the
+    replies of the post, newest first.
+    """
+    posts = session.query(Post).filter(Post.parent_id == None).order_by(  # noqa: E711
+        Post.is_pinned.desc(),
+        Post.internal_time.desc()
+    ).paginate(page, ca.config["POSTS_PER_PAGE"], False)
+
+    post_ids = [p.id for p in posts.items]
+    replies = {post_id: [] for post_id in post_ids}
+    reply_list = []
+    if post_ids:
+        reply_list = session.query(Post).filter(Post.parent_id.in_(post_ids)) \
+            .order_by(Post.timestamp.desc()).all()
+        for r in reply_list:
+            replies[r.parent_id].append(r)
+
+    # attach the authors, so post.author and reply.author are resolved
+    # without a lazy load per row
+    entries = posts.items + reply_list
+    author_ids = {p.user_id for p in entries if p.user_id is not None}
+    authors = {}
+    if author_ids:
+        authors = {u.id: u for u in session.query(User).filter(User.id.in_(author_ids))}
+    for p in entries:
+        set_committed_value(p, "author", authors.get(p.user_id))
+    return posts, replies
+
+
+def record_last_seen(user):
+    """Records a visit at most once per LAST_SEEN_INTERVAL seconds in the
+    last_seen buffer. user.last_seen is set to the recorded visit without
+    marking the user as modified."""
+    now = datetime.utcnow()
+    last_seen = user.last_seen
+    buffered = last_seen_buffer.get(user.id)
+    if buffered is not None and (last_seen is None or buffered > last_seen):
+        last_seen = buffered
+    interval = timedelta(seconds=ca.config["LAST_SEEN_INTERVAL"])
+    if last_seen is None or now - last_seen >= interval:
+        last_seen_buffer.record(user.id, now)
+        last_seen = now
+    set_committed_value(user, "last_seen", last_seen)
+
+
+def __load_badges(user):
+    last_seen = user.last_seen or datetime(1900, 1, 1)
+    activities = select(func.count(Festival.id)) \
+        .where(Festival.modified > last_seen).scalar_subquery()
+    codes = null()
+    if user.is_owner():
+        codes = select(func.count(Registration.id)).scalar_subquery()
+    level_changed = select(Notification.payload_json).where(
+        Notification.user_id == user.id,
+        Notification.name == NotificationType.admin).limit(1).scalar_subquery()
+
+    activities, codes, level_changed = \
+        session.query(activities, codes, level_changed).one()
+    return NavbarBadges(activities, codes,
+                        int(level_changed) if level_changed is not None else 0)
+
+
+def navbar_badges():
+    """Returns the badge values of the navbar, loaded with one query on
+    the first call of a request"""
+    if "navbar_badges" not in g:
+        g.navbar_badges = __load_badges(current_user)
+    return g.navbar_badges
@@ -1,25 +1,30 @@
 from datetime import datetime
 from os import remove, path
 from glob import glob
+from time import monotonic
 
 from flask import render_template, flash, redirect, url_for, request, g, \
-    abort, current_app as ca, jsonify
+    abort, current_app as ca, jsonify, Response, stream_with_context
 from flask_babel import _, get_locale
 from flask_login import login_required, logout_user, current_user as cu
 
-from app import session, photos
+from app import avatars, notification_hub, session, photos
 from app.containers import NotificationType
 from app.main import bp
 from app.main.forms import EditProfileForm, PostForm, AdminPostForm, ReplyForm
+from app.main.logic import load_timeline, navbar_badges, record_last_seen
 from app.models import User, Post, Notification
 from app.festival.logic import get_partner_selection, remove_partner
+from app.notifications import to_event
 
 
 @bp.before_app_request
 def before_request():
-    if cu.is_authenticated:
-        cu.last_seen = datetime.utcnow()
-        session.commit()
+    # g outlives the request if the app context was pushed before
+    g.pop("navbar_badges", None)
+    # static files are no visits, but still get the checks below
+    if cu.is_authenticated and request.endpoint != "static":
+        record_last_seen(cu)
     if not cu.is_anonymous and cu.is_suspended:
         flash(_("Your account has been suspended."))
         ca.logger.info("Suspended user >{}< was kicked from server"
@@ -28,6 +33,11 @@ def before_request():
     g.locale = str(get_locale())
 
 
+@bp.app_context_processor
+def inject_navbar_badges():
+    return {"navbar_badges": navbar_badges}
+
+
 @bp.route("/", methods=["GET", "POST"])
 @bp.route("/index", methods=["GET", "POST"])
 @login_required
@@ -46,10 +56,7 @@ def index():
         flash(_("Your post is now live!"))
         return redirect(url_for("main.index"))
     page = request.args.get("page", 1, type=int)
-    posts = session.query(Post).filter(Post.parent_id == None).order_by(  # noqa: E711
-        Post.is_pinned.desc(),
-        Post.internal_time.desc()
-    ).paginate(page, ca.config["POSTS_PER_PAGE"], False)
+    posts, replies = load_timeline(page)
 
     next_url = url_for("main.index", page=posts.next_num) \
         if posts.has_next else None
@@ -57,6 +64,7 @@ def index():
         if posts.has_prev else None
     return render_template("main/index.html", title=_("Home"),
                            form=form, posts=posts.items,
+                           replies=replies,
                            on_index_page=True,
                            next_url=next_url, prev_url=prev_url)
 
@@ -184,8 +192,10 @@ def edit_profile():
             result = glob(photo_path + search_pattern)
             if len(result) == 1 and path.exists(result[0]):
                 remove(result[0])
-            filename = file_storage[0]
-            photos.save(filename, name=cu.registration_code + ".")
+                avatars.remove(cu.registration_code)
+            filename = photos.save(file_storage[0],
+                                   name=cu.registration_code + ".")
+            avatars.update(cu.registration_code, photos.path(filename))
 
         # -1 will be returned by partner.data, if no partner was selected
         if form.partner.data != -1:
@@ -215,17 +225,86 @@ def edit_profile():
                            form=form)
 
 
+def __load_notifications(user_id, since):
+    notifications = [n.to_dict() for n in session.query(Notification).filter(
+        Notification.user_id == user_id,
+        Notification.timestamp > since).order_by(Notification.timestamp.asc())]
+    # hand the connection back to the pool while the request waits
+    session.rollback()
+    return notifications
+
+
+def __next_notifications(subscription, since, timeout):
+    """Waits up to timeout seconds for the notifications newer than since,
+    which the hub publishes on commit or finds with its poller"""
+    pushed = {(n["name"], n["timestamp"]): n for n in subscription.wait(timeout)
+              if n["timestamp"] > since}
+    return sorted(pushed.values(), key=lambda n: n["timestamp"])
+
+
 @bp.route("/notifications")
 @login_required
 def notifications():
+    """Returns the notifications newer than since. With wait the request
+    is held up to wait seconds (at most 60) until there is one, which
+    serves as long polling fallback for the notification stream. If too
+    many requests are held already, it returns at once and asks the
+    client to retry later."""
     since = request.args.get("since", 0.0, type=float)
-    notification_list = cu.notifications.filter(
-        Notification.timestamp > since).order_by(Notification.timestamp.asc())
-    return jsonify([{
-        "name": n.name,
-        "data": n.get_data(),
-        "timestamp": n.timestamp
-    } for n in notification_list])
+    wait = min(request.args.get("wait", 0.0, type=float), 60.0)
+    subscription = notification_hub.try_subscribe(cu.id) if wait > 0 else None
+    if subscription is None:
+        response = jsonify(__load_notifications(cu.id, since))
+        if wait > 0:
+            response.headers["Retry-After"] = str(int(notification_hub.poll_interval))
+        return response
+    deadline = monotonic() + wait
+    with subscription:
+        notification_list = __load_notifications(subscription.user_id, since)
+        while not notification_list and monotonic() < deadline:
+            notification_list = __next_notifications(subscription, since,
+                                                     deadline - monotonic())
+    return jsonify(notification_list)
+
+
+@bp.route("/notifications/stream")
+@login_required
+def notification_stream():
+    """Streams the notifications as server-sent events. The stream ends
+    after NOTIFICATION_STREAM_TIMEOUT seconds, the browser reconnects and
+    continues after the Last-Event-ID. Beyond NOTIFICATION_MAX_STREAMS
+    the stream is refused and the client falls back to polling."""
+    since = request.headers.get("Last-Event-ID", type=float) \
+        or request.args.get("since", 0.0, type=float)
+    user_id = cu.id
+    subscription = notification_hub.try_subscribe(user_id)
+    if subscription is None:
+        return Response(status=503,
+                        headers={"Retry-After": str(int(notification_hub.poll_interval))})
+
+    def events(since):
+        with subscription:
+            yield "retry: 5000\n\n"
+            deadline = monotonic() + notification_hub.stream_timeout
+            notification_list = __load_notifications(user_id, since)
+            while True:
+                if notification_list:
+                    since = notification_list[-1]["timestamp"]
+                    yield to_event(notification_list)
+                else:
+                    # lets the server notice closed connections
+                    yield ": keep-alive\n\n"
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return
+                notification_list = __next_notifications(
+                    subscription, since, min(remaining, notification_hub.poll_interval))
+
+    response = Response(stream_with_context(events(since)), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # the generator never runs if the client is gone before the first chunk
+    response.call_on_close(lambda: notification_hub.unsubscribe(subscription))
+    return response
 
 
 @bp.route("/user/<username>/popup")
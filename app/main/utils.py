@@ -1,4 +1,3 @@
-import os
 from functools import wraps
 
 from flask import flash, abort, Response
@@ -19,11 +18,10 @@ def not_heroku(func):
     return decorated_view
 
 
-def send_file(file_path: str, filename: str, c_type: str):
-    with open(file_path, "rb") as f:
-        data = f.readlines()
-    os.remove(file_path)
-    return Response(data, headers={
+def send_attachment(body, filename: str, c_type: str):
+    """Sends a download, either rendered in memory (with Content-Length)
+    or streamed from a generator"""
+    return Response(body, headers={
         "Content-Type": c_type,
         "Content-Disposition": "attachment; filename=%s;" % filename
     })
@@ -1,16 +1,16 @@
 import json
 from datetime import datetime
-from glob import glob
+from decimal import Decimal, ROUND_HALF_UP
 from hashlib import md5
 from time import time
 
-from flask import current_app
 from flask_babel import _
 from flask_login import UserMixin
+from sqlalchemy import event
 from sqlalchemy.sql.expression import extract
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from app import db, login
+from app import avatars, db, login, notification_hub
 from app.containers import (ConsumptionItemState, FestivalUpdateInfo,
                             NotificationType, UserAccessLevel)
 
@@ -21,6 +21,12 @@ from app.containers import (ConsumptionItemState, FestivalUpdateInfo,
 session = db.session
 
 
+def to_cents(amount):
+    """Converts a monetary amount into exact integer cents"""
+    cents = Decimal(str(amount)).quantize(Decimal("0.01"), ROUND_HALF_UP)
+    return int(cents * 100)
+
+
 @login.user_loader
 def load_user(user_id):
     return session.query(User).get(int(user_id))
@@ -79,10 +85,11 @@ class User(UserMixin, db.Model):
     water_demand = db.Column(db.Integer, nullable=False, default=0)
     beer_demand = db.Column(db.Integer, nullable=False, default=0)
     mixed_demand = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, index=True, nullable=False,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # needed in module "festival"
     partner_id = db.Column(db.Integer, db.ForeignKey("user.id"))
-    dept = 0.0
     invoices = db.relationship("Invoice",
                                backref="creditor", lazy="dynamic")
     incoming_transfers = db.relationship(
@@ -111,12 +118,8 @@ class User(UserMixin, db.Model):
             digest = md5(digest.encode("utf-8")).hexdigest()
             return "https://www.gravatar.com/avatar/{}?d=identicon&s={}" \
                 .format(digest, size)
-        photo_path = current_app.config["UPLOADED_PHOTOS_DEST"]
-        search_pattern = "/*{}*".format(self.registration_code)
-        current_photo = glob(photo_path + search_pattern)
-        if len(current_photo) == 1:
-            split = current_photo[0].split(sep="/")
-            img_src = "/%s/%s/%s" % (split[-3], split[-2], split[-1])
+        img_src = avatars.lookup(self.registration_code)
+        if img_src is not None:
             return img_src
 
         if digest is None:
@@ -148,8 +151,10 @@ class User(UserMixin, db.Model):
 
     def add_notification(self, name, data):
         self.notifications.filter_by(name=name).delete()
-        n = Notification(name=name, payload_json=json.dumps(data), user_id=self.id)
+        n = Notification(name=name, payload_json=json.dumps(data), user_id=self.id,
+                         timestamp=time())
         db.session.add(n)
+        notification_hub.publish_after_commit(db.session, self.id, n.to_dict())
         return n
 
     def is_owner(self):
@@ -185,6 +190,8 @@ class Post(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
 
     parent_id = db.Column(db.Integer, db.ForeignKey("post.id"))
+    updated_at = db.Column(db.DateTime, index=True, nullable=False,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def get_replies(self):
         return session.query(Post).filter(Post.parent_id == self.id).order_by(
@@ -223,11 +230,13 @@ class Festival(db.Model):
         if not self.contains_user(user):
             self.participants.append(user)
             self.update_info = FestivalUpdateInfo.user_joined
+            self.modified = datetime.utcnow()
 
     def leave(self, user):
         if self.contains_user(user):
             self.participants.remove(user)
             self.update_info = FestivalUpdateInfo.user_left
+            self.modified = datetime.utcnow()
 
     def contains_user(self, user):
         return self.participants.filter(
@@ -243,24 +252,38 @@ class Festival(db.Model):
 class Invoice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(30), index=True)
-    amount = db.Column(db.Float)
+    amount_cents = db.Column(db.Integer, nullable=False, default=0)
     creditor_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     festival_id = db.Column(db.Integer, db.ForeignKey("festival.id"))
+    updated_at = db.Column(db.DateTime, index=True, nullable=False,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
 
     sharers = db.relationship(
         "User", secondary=sharers,
         primaryjoin=(sharers.c.invoice_id == id),
         backref=db.backref("sharers", lazy="dynamic"), lazy="dynamic")
 
+    @property
+    def amount(self):
+        return self.amount_cents / 100
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_cents = to_cents(value)
+
     def add_sharer(self, user):
         if not self.contains_user(user):
             self.sharers.append(user)
+            self.updated_at = datetime.utcnow()
 
     def remove_sharer(self, user):
         if self.contains_user(user):
             self.sharers.remove(user)
+            self.updated_at = datetime.utcnow()
 
     def set_sharers(self, sharer_ids):
+        # the sharers are part of the invoice in the delta backups
+        self.updated_at = datetime.utcnow()
         users = session.query(User).filter(User.id.in_(sharer_ids)).all()
         for u in users:
             if not self.contains_user(u):
@@ -283,7 +306,17 @@ class Transfer(db.Model):
     festival_id = db.Column(db.Integer, db.ForeignKey("festival.id"))
     recipient_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     payer_id = db.Column(db.Integer, db.ForeignKey("user.id"))
-    amount = db.Column(db.Float)
+    amount_cents = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, index=True, nullable=False,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def amount(self):
+        return self.amount_cents / 100
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_cents = to_cents(value)
 
     def __repr__(self):
         return "<Transfer {}>".format(self.id)
@@ -299,6 +332,13 @@ class Notification(db.Model):
     def get_data(self):
         return json.loads(str(self.payload_json))
 
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "data": self.get_data(),
+            "timestamp": self.timestamp
+        }
+
 
 class Registration(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -315,6 +355,8 @@ class ConsumptionItem(db.Model):
     amount = db.Column(db.Integer, nullable=False, default=1)
     requestor_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     festival_id = db.Column(db.Integer, db.ForeignKey("festival.id"))
+    updated_at = db.Column(db.DateTime, index=True, nullable=False,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return "<ConsumptionItem {}>".format(self.id)
@@ -326,16 +368,28 @@ class PackagingUnitType(db.Model):
     name = db.Column(db.String(30), nullable=False)
     abbreviation = db.Column(db.String(5), nullable=False)
     delete = db.Column(db.Boolean, nullable=False, default=True)
+    # comma separated package sizes the unit is sold in, e.g. "24,18" cans
+    package_sizes = db.Column(db.String(30))
+    updated_at = db.Column(db.DateTime, index=True, nullable=False,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return "<PackagingUnitType {}>".format(self.id)
 
+    def sizes(self):
+        if not self.package_sizes:
+            return ()
+        return tuple(sorted({int(s) for s in self.package_sizes.split(",")},
+                            reverse=True))
+
 
 class UtilityItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30), index=True)
     owner_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     description = db.Column(db.String(150))
+    updated_at = db.Column(db.DateTime, index=True, nullable=False,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
         return "<UtilityItem {}>".format(self.id)
@@ -350,6 +404,8 @@ class ChronicleEntry(db.Model):
     internal_time = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     year = db.Column(db.Integer, nullable=False)
     festival_id = db.Column(db.Integer, db.ForeignKey("festival.id"))
+    updated_at = db.Column(db.DateTime, index=True, nullable=False,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def get_title(self):
         title = self.body.splitlines()[0]
@@ -365,3 +421,36 @@ class ChronicleEntry(db.Model):
 
     def __repr__(self):
         return "<ChronicleEntry {}>".format(self.get_title())
+
+
+class Tombstone(db.Model):
+    """Remembers deleted rows, so delta backups can replay deletions"""
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, index=True, nullable=False,
+                           default=datetime.utcnow)
+
+    def __repr__(self):
+        return "<Tombstone {} {}>".format(self.table_name, self.row_id)
+
+
+def record_deletion(mapper, connection, target):
+    connection.execute(Tombstone.__table__.insert().values(
+        table_name=mapper.local_table.name, row_id=target.id,
+        deleted_at=datetime.utcnow()))
+
+
+def record_bulk_deletion(model, ids):
+    """Query.delete() bypasses the after_delete listener, bulk deletions
+    of exported models have to record their tombstones with this"""
+    deleted_at = datetime.utcnow()
+    db.session.execute(Tombstone.__table__.insert(), [
+        {"table_name": model.__table__.name, "row_id": row_id,
+         "deleted_at": deleted_at} for row_id in ids])
+
+
+# models exported by the backup, see app.administration.backup_export
+for model in (User, Post, Festival, Invoice, Transfer, ConsumptionItem,
+              PackagingUnitType, UtilityItem, ChronicleEntry):
+    event.listen(model, "after_delete", record_deletion)
@@ -0,0 +1,182 @@
+import json
+import queue
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class Subscription(object):
+
+    def __init__(self, hub, user_id):
+        self.hub = hub
+        self.user_id = user_id
+        self._queue = queue.SimpleQueue()
+
+    def put(self, notification):
+        self._queue.put(notification)
+
+    def wait(self, timeout):
+        """Returns the notifications published so far, waits up to timeout
+        seconds for the first one"""
+        try:
+            notifications = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                notifications.append(self._queue.get_nowait())
+            except queue.Empty:
+                return notifications
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.hub.unsubscribe(self)
+
+
+# seconds the poller looks back before the newest notification it has
+# seen, a notification is stamped before its transaction commits
+POLL_OVERLAP = 60.0
+
+
+class NotificationHub(object):
+    """Fans out new notifications to the streams waiting for them.
+
+    Notifications queued with publish_after_commit are handed to the
+    subscriptions of their user once the session commits, and are dropped
+    on rollback. The hub only sees the commits of this process, so one
+    poller thread checks the database every NOTIFICATION_POLL_INTERVAL
+    seconds for the notifications of all subscribed users added by other
+    worker processes. It runs from the first subscription on, in testing
+    mode poll() has to be called instead.
+
+    Every open stream holds a worker thread, try_subscribe() refuses more
+    than NOTIFICATION_MAX_STREAMS subscriptions.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.polling = False
+        self.poll_interval = 15.0
+        self.stream_timeout = 300.0
+        self.max_streams = 0
+        self._subscriptions = {}
+        self._count = 0
+        self._polled = 0.0
+        self._delivered = set()
+        self._poller = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.polling = app.config.get("NOTIFICATION_POLLING", not app.testing)
+        self.poll_interval = app.config.get("NOTIFICATION_POLL_INTERVAL", 15.0)
+        self.stream_timeout = app.config.get("NOTIFICATION_STREAM_TIMEOUT", 300.0)
+        self.max_streams = app.config.get("NOTIFICATION_MAX_STREAMS", 0)
+        with self._lock:
+            self._subscriptions = {}
+            self._count = 0
+        if not event.contains(Session, "after_commit", self.__after_commit):
+            event.listen(Session, "after_commit", self.__after_commit)
+            event.listen(Session, "after_soft_rollback", self.__after_rollback)
+
+    def subscribe(self, user_id):
+        return self.__subscribe(user_id, limit=0)
+
+    def try_subscribe(self, user_id):
+        """Subscribes unless NOTIFICATION_MAX_STREAMS subscriptions are
+        open already, then it returns None"""
+        return self.__subscribe(user_id, limit=self.max_streams)
+
+    def __subscribe(self, user_id, limit):
+        subscription = Subscription(self, user_id)
+        with self._lock:
+            if limit and self._count >= limit:
+                return None
+            if not self._count:
+                # the subscriber loads everything older itself
+                self._polled = time.time()
+                self._delivered = set()
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            self._count += 1
+            if self.polling and self._poller is None:
+                self._poller = threading.Thread(target=self.__poll_forever,
+                                                name="notification-poller",
+                                                daemon=True)
+                self._poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, set())
+            if subscription in subscriptions:
+                subscriptions.discard(subscription)
+                self._count -= 1
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def poll(self):
+        """Publishes the notifications added since the last poll, with one
+        query for all subscribed users. The query looks POLL_OVERLAP seconds
+        back, so it also finds notifications which were committed after
+        the last poll with an older timestamp."""
+        from app import db
+        from app.models import Notification
+        with self._lock:
+            user_ids = list(self._subscriptions)
+            since = self._polled - POLL_OVERLAP
+        if not user_ids:
+            return
+        with self.app.app_context(), Session(db.engine) as session:
+            notifications = [((n.id, n.timestamp), n.user_id, n.to_dict())
+                             for n in session.query(Notification)
+                             .filter(Notification.user_id.in_(user_ids),
+                                     Notification.timestamp > since)
+                             .order_by(Notification.timestamp.asc())]
+        with self._lock:
+            new = [(user_id, notification) for key, user_id, notification
+                   in notifications if key not in self._delivered]
+            # older keys are out of the window of the next poll
+            self._delivered = {key for key, _, _ in notifications}
+            if notifications:
+                self._polled = max(self._polled, notifications[-1][0][1])
+        for user_id, notification in new:
+            self.publish(user_id, notification)
+
+    def __poll_forever(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except Exception:
+                self.app.logger.exception("notification poll failed")
+
+    def publish(self, user_id, notification):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.put(notification)
+
+    @staticmethod
+    def publish_after_commit(session, user_id, notification):
+        session.info.setdefault("notifications", []).append((user_id, notification))
+
+    def __after_commit(self, session):
+        for user_id, notification in session.info.pop("notifications", ()):
+            self.publish(user_id, notification)
+
+    @staticmethod
+    def __after_rollback(session, previous_transaction):
+        session.info.pop("notifications", None)
+
+
+def to_event(notifications):
+    """Formats the notifications as one server-sent event, the timestamp
+    of the newest is the event id"""
+    return "id: {}\ndata: {}\n\n".format(notifications[-1]["timestamp"],
+                                         json.dumps(notifications))
@@ -4,7 +4,7 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, DecimalField, SelectField, \
     TextAreaField
 from wtforms.validators import DataRequired, ValidationError, NumberRange, \
-    Length
+    Length, Optional, Regexp
 
 from app import session
 from app.models import ConsumptionItem, PackagingUnitType, UtilityItem
@@ -89,6 +89,11 @@ class PKUForm(FlaskForm):
     abbreviation = StringField(_l("Abbreviation"),
                                validators=[DataRequired(),
                                            Length(min=1, max=5)])
+    package_sizes = StringField(_l("Package sizes"), validators=[
+        Optional(),
+        Length(max=30),
+        Regexp(r"^\s*[1-9][0-9]*(\s*,\s*[1-9][0-9]*)*\s*$",
+               message=_l("Comma separated numbers, e.g. 24,18"))])
     submit = SubmitField(_l("Submit"))
 
     def validate_name(self, name):
@@ -1,21 +1,22 @@
-import os
-from math import ceil
+from io import BytesIO
 
 from docx import Document
+from docx.table import _Cell
 from flask import redirect, url_for, flash
-from flask_babel import _
+from flask_babel import _, get_locale
 from flask_login import current_user
-from sqlalchemy import or_, not_
+from sqlalchemy import bindparam, func, not_, or_
 
-from app import session
+from app import docx_cache, reference_cache, session
 from app.containers import ConsumptionItemState
-from app.festival.logic import load_participants_from_db
-from app.main.utils import send_file
-from app.models import PackagingUnitType, ConsumptionItem, Festival, User
-from config import Config
+from app.main.utils import send_attachment
+from app.models import PackagingUnitType, ConsumptionItem, Festival, User, \
+    record_bulk_deletion
+from app.purchase.planning import format_mix, load_catalog, plan_drinks
+from app.reference_cache import FESTIVAL_SELECTION, PKU_SELECTION
 
 
-def get_pku_selection():
+def __query_pku_selection():
     result = [(-1, "")]
     types = session.query(PackagingUnitType).all()
     for t in types:
@@ -23,7 +24,7 @@ def get_pku_selection():
     return result
 
 
-def get_festivals():
+def __query_festivals():
     result = [(-1, "")]
     festivals = session.query(Festival).filter(not_(Festival.is_closed)).all()
     for f in festivals:
@@ -31,6 +32,15 @@ def get_festivals():
     return result
 
 
+def get_pku_selection():
+    # WTForms must not append to the cached list
+    return list(reference_cache.get(PKU_SELECTION, __query_pku_selection))
+
+
+def get_festivals():
+    return list(reference_cache.get(FESTIVAL_SELECTION, __query_festivals))
+
+
 def calculate_redirect(item):
     if item.state == ConsumptionItemState.stock:
         return redirect(url_for("purchase.stock_overview"))
@@ -47,119 +57,152 @@ def check_shopping_empty():
     return shopping_list_len == 0
 
 
-def get_pallets(amount, size, days):
-    return ceil((amount * days) / size)
-
-
 def calculate_drinks(festival_id, is_testing):
-    festival = session.query(Festival).get(festival_id)
-    duration = festival.end_date - festival.start_date
-    days = duration.days + 1
-    beer_amount = mixed_amount = water_amount = 0
-    for p in load_participants_from_db(festival_id):
-        beer_amount += p.beer_demand
-        mixed_amount += p.mixed_demand
-        water_amount += p.water_demand
-    beer_large_pallets = get_pallets(beer_amount, 24, days)
-    mixed_large_pallets = get_pallets(mixed_amount, 24, days)
-    beer_small_pallets = get_pallets(beer_amount, 18, days)
-    mixed_small_pallets = get_pallets(mixed_amount, 18, days)
-    water_pallets = get_pallets(water_amount, (6 * 1.5), days)
-
-    six = session.query(PackagingUnitType).filter_by(internal_name="Sixpacks").first()
-    cns = session.query(PackagingUnitType).filter_by(internal_name="Cans").first()
-
-    beer_info = "{}x24 or {}x18".format(beer_large_pallets, beer_small_pallets)
-    mixed_info = "{}x24 or {}x18".format(mixed_large_pallets,
-                                         mixed_small_pallets)
-    water_info = "6x1.5l"
+    catalog = load_catalog()
+    plan = plan_drinks([festival_id], catalog)[festival_id]
 
     user = current_user
     if is_testing:
         user = session.query(User).get(1)
 
+    cns = catalog["Cans"]
+    six = catalog["Sixpacks"]
     beer = ConsumptionItem(name=_("Beer"), pku_id=cns.id,
-                           amount=(beer_amount * days),
-                           info=beer_info,
+                           amount=plan.beer,
+                           info=format_mix(plan.beer_packages),
                            requestor=user)
     mixed = ConsumptionItem(name=_("Mixed"), pku_id=cns.id,
-                            amount=(mixed_amount * days),
-                            info=mixed_info,
+                            amount=plan.mixed,
+                            info=format_mix(plan.mixed_packages),
                             requestor=user)
     water = ConsumptionItem(name=_("Water"), pku_id=six.id,
-                            amount=water_pallets,
-                            info=water_info,
+                            amount=plan.water,
+                            info="6x1.5l",
                             requestor=user)
     session.add_all([beer, mixed, water])
     session.commit()
 
 
+def __reconcile(stock, requested):
+    """Splits the requested (id, name, amount) rows into the ids which are
+    covered by the stock, the ids which have to be bought completely and
+    the remaining amounts of the partially covered ones"""
+    covered, missing, remaining = [], [], []
+    for item_id, name, amount in requested:
+        available = stock.get(name)
+        if available is None:
+            missing.append(item_id)
+        elif amount - available <= 0:
+            # demand can be satisfied from stock
+            covered.append(item_id)
+        else:
+            remaining.append({"b_id": item_id, "amount": amount - available})
+    return covered, missing, remaining
+
+
 def generate_shopping_list(festival_id, is_testing=False):
     calculate_drinks(festival_id, is_testing)
-    requested_items = session.query(ConsumptionItem).filter_by(
-        state=ConsumptionItemState.wishlist).all()
-    for r in requested_items:
-        r.festival_id = festival_id
-        available: ConsumptionItem = session.query(ConsumptionItem).filter(
-            ConsumptionItem.state == ConsumptionItemState.stock,
-            ConsumptionItem.name == r.name
-        ).first()
-        if available:
-            adjust_amount(available, r)
-        else:
-            r.state = ConsumptionItemState.purchase
+
+    # the first stock item of each name is compared with the request
+    stock = {}
+    for name, amount in session.query(ConsumptionItem.name, ConsumptionItem.amount) \
+            .filter_by(state=ConsumptionItemState.stock) \
+            .order_by(ConsumptionItem.id):
+        stock.setdefault(name, amount)
+    requested = session.query(ConsumptionItem.id, ConsumptionItem.name,
+                              ConsumptionItem.amount) \
+        .filter_by(state=ConsumptionItemState.wishlist).all()
+    covered, missing, remaining = __reconcile(stock, requested)
+
+    items = ConsumptionItem.__table__
+    if covered:
+        session.query(ConsumptionItem).filter(ConsumptionItem.id.in_(covered)) \
+            .delete(synchronize_session=False)
+        record_bulk_deletion(ConsumptionItem, covered)
+    if missing:
+        session.query(ConsumptionItem).filter(ConsumptionItem.id.in_(missing)) \
+            .update({ConsumptionItem.state: ConsumptionItemState.purchase,
+                     ConsumptionItem.festival_id: festival_id},
+                    synchronize_session=False)
+    if remaining:
+        session.execute(items.update().where(items.c.id == bindparam("b_id"))
+                        .values(state=ConsumptionItemState.purchase,
+                                festival_id=festival_id), remaining)
     session.commit()
+    docx_cache.invalidate()
     if not is_testing:
         flash(_("List generated."))
         return redirect(url_for("purchase.shopping_list", festival_id=festival_id))
 
 
-def adjust_amount(available: ConsumptionItem, requested: ConsumptionItem):
-    p_amount = requested.amount - available.amount
-    if p_amount <= 0:
-        # demand can be satisfied from stock
-        session.delete(requested)
-    else:
-        requested.amount = p_amount
-        requested.state = ConsumptionItemState.purchase
+def __row_cells(row):
+    # table.cell(r, c) and, in python-docx 0.8, row.cells rebuild the cell
+    # grid of the whole table, wrapping the new <w:tc> elements stays linear
+    return [_Cell(tc, row.table) for tc in row._tr.tc_lst]
+
+
+def __shopping_list_fingerprint():
+    """Changes whenever a purchase item, its packaging unit or festival
+    is added, removed or updated"""
+    count, max_id, id_sum, items_updated, pkus_updated, festivals_modified = \
+        session.query(func.count(ConsumptionItem.id),
+                      func.max(ConsumptionItem.id),
+                      func.sum(ConsumptionItem.id),
+                      func.max(ConsumptionItem.updated_at),
+                      func.max(PackagingUnitType.updated_at),
+                      func.max(Festival.modified)) \
+        .join(PackagingUnitType) \
+        .outerjoin(Festival, Festival.id == ConsumptionItem.festival_id) \
+        .filter(ConsumptionItem.state == ConsumptionItemState.purchase).one()
+    if count == 0:
+        return None
+    return (str(get_locale()), count, max_id, id_sum, items_updated,
+            pkus_updated, festivals_modified)
+
+
+def __render_docx():
+    lines = session.query(ConsumptionItem, PackagingUnitType) \
+        .join(PackagingUnitType).filter(
+        ConsumptionItem.state == ConsumptionItemState.purchase)
+
+    document = None
+    table = None
+    for ci, pku in lines:
+        if document is None:
+            festival = session.query(Festival).filter_by(id=ci.festival_id).first()
+            document = Document()
+            document.add_heading(festival.title)
+            table = document.add_table(rows=1, cols=3)
+            table.style = "LightShading-Accent1"
+            for cell, header in zip(__row_cells(table.rows[0]),
+                                    [_("Article"), _("Amount"), _("Info")]):
+                cell.text = header
+
+        article, amount, info = __row_cells(table.add_row())
+        article.text = ci.name
+        amount.text = "{} {}".format(ci.amount, pku.abbreviation)
+        if ci.info:
+            info.text = ci.info
+
+    if document is None:
+        return None
+
+    buffer = BytesIO()
+    document.save(buffer)
+    return "{}.docx".format(festival.title), buffer.getvalue()
 
 
 def export_and_download_docx():
-    lines = session.query(ConsumptionItem, PackagingUnitType) \
-        .join(PackagingUnitType).filter(
-        ConsumptionItem.state == ConsumptionItemState.purchase).all()
-    length = len(lines)
-    if length == 0:
+    key = __shopping_list_fingerprint()
+    if key is None:
         return
 
-    festival_id: int = lines[0].ConsumptionItem.festival_id
-    festival = session.query(Festival).filter_by(id=festival_id).first()
-
-    document = Document()
-    document.add_heading(festival.title)
-    rows = length + 1
-    columns = 3
-    table = document.add_table(rows=rows, cols=columns)
-    table.style = "LightShading-Accent1"
-    table_headers = [_("Article"), _("Amount"), _("Info")]
-    for r in range(rows):
-        for c in range(columns):
-            cell = table.cell(r, c)
-            if r == 0:
-                cell.text = table_headers[c]
-            else:
-                ci: ConsumptionItem = lines[r - 1].ConsumptionItem
-                if c == 0:
-                    cell.text = ci.name
-                elif c == 1:
-                    pku: PackagingUnitType = lines[r - 1].PackagingUnitType
-                    cell.text = "{} {}".format(ci.amount, pku.abbreviation)
-                else:
-                    if ci.info:
-                        cell.text = ci.info
-
-    filename = "{}.docx".format(festival.title)
-    file_path = os.path.join(Config.SHOPPING_LIST_PATH, filename)
-    document.save(file_path)
-
-    return send_file(file_path, filename, "text/docx")
+    rendered = docx_cache.get(key)
+    if rendered is None:
+        rendered = __render_docx()
+        if rendered is None:
+            return
+        docx_cache.put(key, rendered, len(rendered[1]))
+
+    filename, data = rendered
+    return send_attachment(data, filename, "text/docx")
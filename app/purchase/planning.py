@@ -0,0 +1,107 @@
+from collections import namedtuple
+from functools import lru_cache
+from math import ceil
+
+from sqlalchemy import func, not_
+
+from app import reference_cache, session
+from app.models import Festival, PackagingUnitType, User, participants as prts
+from app.reference_cache import DRINK_CATALOG
+
+# liters of water in a sixpack of 1.5l bottles
+WATER_PER_SIXPACK = 6 * 1.5
+
+# packaging units the drinks are bought in
+DRINK_UNITS = ("Cans", "Sixpacks")
+
+Packaging = namedtuple("Packaging", ["id", "name", "sizes"])
+
+Demand = namedtuple("Demand", ["festival_id", "title", "days",
+                               "beer", "mixed", "water"])
+
+DrinkPlan = namedtuple("DrinkPlan", ["demand", "beer", "mixed", "water",
+                                     "beer_packages", "mixed_packages"])
+
+
+def __query_catalog():
+    pkus = session.query(PackagingUnitType) \
+        .filter(PackagingUnitType.internal_name.in_(DRINK_UNITS)).all()
+    return {p.internal_name: Packaging(p.id, p.name, p.sizes()) for p in pkus}
+
+
+def load_catalog():
+    """Returns the drink packaging units by internal name"""
+    return reference_cache.get(DRINK_CATALOG, __query_catalog)
+
+
+def load_demand(festival_ids=None):
+    """Sums the daily drink demand of the participants of every festival
+    with one query, by default for all open festivals"""
+    query = session.query(
+        Festival.id, Festival.title, Festival.start_date, Festival.end_date,
+        func.coalesce(func.sum(User.beer_demand), 0),
+        func.coalesce(func.sum(User.mixed_demand), 0),
+        func.coalesce(func.sum(User.water_demand), 0)) \
+        .outerjoin(prts, prts.c.festival_id == Festival.id) \
+        .outerjoin(User, User.id == prts.c.participant_id) \
+        .group_by(Festival.id, Festival.title, Festival.start_date,
+                  Festival.end_date) \
+        .order_by(Festival.start_date, Festival.id)
+    if festival_ids is None:
+        query = query.filter(not_(Festival.is_closed))
+    else:
+        query = query.filter(Festival.id.in_(festival_ids))
+
+    result = []
+    for f_id, title, start, end, beer, mixed, water in query:
+        days = (end - start).days + 1
+        result.append(Demand(f_id, title, days, beer, mixed, water))
+    return result
+
+
+@lru_cache(maxsize=1024)
+def best_mix(amount, sizes):
+    """Returns the (size, count) pairs of the packages which cover amount
+    with the least leftover, ties are broken by the number of packages"""
+    if amount <= 0 or not sizes:
+        return ()
+    limit = amount + max(sizes) - 1
+    # fewest packages for each reachable total and the size added last
+    packages = [0] + [None] * limit
+    last = [0] * (limit + 1)
+    for total in range(1, limit + 1):
+        for size in sizes:
+            if size > total or packages[total - size] is None:
+                continue
+            if packages[total] is None or packages[total - size] + 1 < packages[total]:
+                packages[total] = packages[total - size] + 1
+                last[total] = size
+
+    total = next(t for t in range(amount, limit + 1) if packages[t] is not None)
+    counts = {}
+    while total:
+        counts[last[total]] = counts.get(last[total], 0) + 1
+        total -= last[total]
+    return tuple(sorted(counts.items(), reverse=True))
+
+
+def format_mix(mix):
+    return " + ".join("{}x{}".format(count, size) for size, count in mix)
+
+
+def plan_drinks(festival_ids=None, catalog=None):
+    """Plans the drinks of all given festivals, see load_demand"""
+    if catalog is None:
+        catalog = load_catalog()
+    cans = catalog.get("Cans")
+    sizes = cans.sizes if cans is not None else ()
+
+    plans = {}
+    for demand in load_demand(festival_ids):
+        beer = demand.beer * demand.days
+        mixed = demand.mixed * demand.days
+        water = ceil(demand.water * demand.days / WATER_PER_SIXPACK)
+        plans[demand.festival_id] = DrinkPlan(demand, beer, mixed, water,
+                                              best_mix(beer, sizes),
+                                              best_mix(mixed, sizes))
+    return plans
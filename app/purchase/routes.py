@@ -4,8 +4,9 @@ from flask_babel import _
 from flask_login import login_required, current_user
 from sqlalchemy import or_
 
-from app import session
+from app import docx_cache, session
 from app.containers import ConsumptionItemState
+from app.logic import invalidate_pku_references
 from app.models import ConsumptionItem, PackagingUnitType, UtilityItem
 from app.purchase import bp
 from app.purchase.logic import get_pku_selection, get_festivals, \
@@ -15,6 +16,11 @@ from app.purchase.forms import StockForm, SelectFestivalForm, PKUForm, \
 from app.purchase.messages import shopping_list_not_empty
 
 
+def __package_sizes(form):
+    sizes = form.package_sizes.data.replace(" ", "")
+    return sizes or None
+
+
 @bp.route("/stock_overview", methods=["GET", "POST"])
 @login_required
 def stock_overview():
@@ -111,6 +117,7 @@ def finish_purchase():
             else:
                 i.state = ConsumptionItemState.stock
         session.commit()
+        docx_cache.invalidate()
         ca.logger.info(
             ">{}< has finished purchase".format(current_user.username))
         return redirect(url_for("purchase.stock_overview"))
@@ -128,6 +135,7 @@ def check_off(item_id):
     item = session.query(ConsumptionItem).get(item_id)
     item.state = ConsumptionItemState.cart
     session.commit()
+    docx_cache.invalidate()
     ca.logger.info(
         ">{}< has added >{}< to cart"
         .format(current_user.username, item.name))
@@ -198,6 +206,7 @@ def edit_item(item_id):
             item.amount = form.amount.data
             item.pku_id = form.unit.data
             session.commit()
+            docx_cache.invalidate()
             ca.logger.info(
                 ">{}< has edited item >{}<"
                 .format(current_user.username, item.id))
@@ -227,6 +236,7 @@ def delete_item(item_id):
     state = ci.state
     session.delete(ci)
     session.commit()
+    docx_cache.invalidate()
     ca.logger.info(
         ">{}< has deleted item >{}<"
         .format(current_user.username, ci.name))
@@ -267,6 +277,7 @@ def delete_pku(pku_id):
         if pku.delete:
             session.delete(pku)
             session.commit()
+            invalidate_pku_references()
             ca.logger.info(
                 ">{}< has deleted pku >{}<"
                 .format(current_user.username, pku.name))
@@ -289,7 +300,9 @@ def edit_pku(pku_id):
         if form.validate_on_submit():
             pku.name = form.name.data
             pku.abbreviation = form.abbreviation.data
+            pku.package_sizes = __package_sizes(form)
             session.commit()
+            invalidate_pku_references()
             ca.logger.info(
                 ">{}< has edited PKU >{}<"
                 .format(current_user.username, pku.id))
@@ -298,6 +311,7 @@ def edit_pku(pku_id):
         elif request.method == "GET":
             form.name.data = pku.name
             form.abbreviation.data = pku.abbreviation
+            form.package_sizes.data = pku.package_sizes
 
         return render_template("add_form.html",
                                form=form, heading=_("Edit packaging unit"))
@@ -317,9 +331,11 @@ def add_pku():
             abbreviation = form.abbreviation.data
             pku = PackagingUnitType(name=name,
                                     abbreviation=abbreviation,
+                                    package_sizes=__package_sizes(form),
                                     internal_name="")
             session.add(pku)
             session.commit()
+            invalidate_pku_references()
             ca.logger.info(
                 ">{}< has added PKU >{}<"
                 .format(current_user.username, pku.id))
@@ -0,0 +1,57 @@
+import time
+from threading import Lock
+
+# cache entries of the purchase selection lists and the drink catalog
+PKU_SELECTION = "pku_selection"
+FESTIVAL_SELECTION = "festival_selection"
+DRINK_CATALOG = "drink_catalog"
+
+
+class ReferenceCache(object):
+    """Process local read-through cache for rarely changing reference data.
+
+    get() returns the cached value of a name or stores the result of its
+    loader. The code changing the underlying tables calls invalidate().
+    Other worker processes don't see these calls, so values expire after
+    REFERENCE_CACHE_TTL seconds; 0 keeps them until invalidated. Values
+    must not be ORM instances, they outlive the session which loaded them.
+    """
+
+    def __init__(self, app=None, clock=time.monotonic):
+        self.ttl = 0
+        self.clock = clock
+        self.loads = 0
+        self._values = {}
+        self._generation = 0
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get("REFERENCE_CACHE_TTL", 0)
+        self.invalidate()
+
+    def get(self, name, load):
+        entry = self._values.get(name)
+        now = self.clock()
+        if entry is not None and (not self.ttl or now < entry[1]):
+            return entry[0]
+
+        generation = self._generation
+        value = load()
+        with self._lock:
+            self.loads += 1
+            # an invalidation during the load might have missed the change
+            if generation == self._generation:
+                self._values[name] = (value, now + self.ttl)
+        return value
+
+    def invalidate(self, *names):
+        """Drops the given names, or everything without names"""
+        with self._lock:
+            self._generation += 1
+            if names:
+                for name in names:
+                    self._values.pop(name, None)
+            else:
+                self._values.clear()
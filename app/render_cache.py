@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class RenderCache(object):
+    """LRU cache for rendered documents.
+
+    Entries are looked up by a fingerprint of the data they were rendered
+    from, so a stale entry is never returned even if another worker process
+    changed the data. invalidate() only frees the memory early. The cache
+    holds at most RENDER_CACHE_SIZE bytes, the least recently used entries
+    are evicted first.
+    """
+
+    def __init__(self, app=None):
+        self.max_size = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_size = app.config.get("RENDER_CACHE_SIZE", 0)
+        self.invalidate()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                self.size -= self._entries.popitem(last=False)[1][1]
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
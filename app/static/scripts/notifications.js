@@ -46,24 +46,52 @@ function setNotificationUpdate(n, spanId) {
     $("#".concat(spanId)).css("visibility", n ? "visible" : "hidden");
 }
 
-function updateNotifications(since) {
-    $.ajax("/notifications?since=" + since).done(
-        function(notifications) {
-            for (var i = 0; i < notifications.length; i++) {
-                if (notifications[i].name == "festival_updated")
-                    setNotificationUpdate(notifications[i].data, "festival_count");
-                if (notifications[i].name == "no_registration_codes")
-                    setNotificationUpdate(notifications[i].data, "available_codes");
-                if (notifications[i].name == "admin")
-                    setNotificationUpdate(notifications[i].data, "admin_changed");
-                since = notifications[i].timestamp;
-            }
+function showNotifications(notifications) {
+    for (var i = 0; i < notifications.length; i++) {
+        if (notifications[i].name == "festival_updated")
+            setNotificationUpdate(notifications[i].data, "festival_count");
+        if (notifications[i].name == "no_registration_codes")
+            setNotificationUpdate(notifications[i].data, "available_codes");
+        if (notifications[i].name == "admin")
+            setNotificationUpdate(notifications[i].data, "admin_changed");
+    }
+}
+
+// fallback for browsers without EventSource or when the server refuses
+// the stream: the server holds each request until there is a new
+// notification, unless it asks to retry later
+function pollNotifications(since) {
+    $.ajax("/notifications?wait=60&since=" + since).done(
+        function(notifications, status, xhr) {
+            showNotifications(notifications);
+            if (notifications.length)
+                since = notifications[notifications.length - 1].timestamp;
+            var retryAfter = Number(xhr.getResponseHeader("Retry-After")) || 0;
+            setTimeout(function() { pollNotifications(since); }, retryAfter * 1000);
+        }
+    ).fail(
+        function() {
+            setTimeout(function() { pollNotifications(since); }, 10000);
         }
     );
-    setTimeout(updateNotifications, 10000)
 }
 
 $(function() {
-    var since = 0;
-    updateNotifications(since);
-});
\ No newline at end of file
+    if (window.EventSource) {
+        // reconnects by itself and continues after the last event id
+        var source = new EventSource("/notifications/stream");
+        var since = 0;
+        source.onmessage = function(event) {
+            since = event.lastEventId;
+            showNotifications(JSON.parse(event.data));
+        };
+        source.onerror = function() {
+            // closed for good, e.g. the server has too many open streams
+            if (source.readyState == EventSource.CLOSED)
+                setTimeout(function() { pollNotifications(since); }, 10000);
+        };
+    }
+    else {
+        pollNotifications(0);
+    }
+});
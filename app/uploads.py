@@ -0,0 +1,24 @@
+from flask import Request, current_app
+
+
+def upload_limit(config_key):
+    """Lets the view accept request bodies up to the size in config_key
+    instead of MAX_CONTENT_LENGTH. Must be applied below the route."""
+    def decorator(func):
+        func.upload_limit = config_key
+        return func
+
+    return decorator
+
+
+class UploadRequest(Request):
+    """Request which honours the upload_limit of the matched view"""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint is not None:
+            view = current_app.view_functions.get(self.endpoint)
+            config_key = getattr(view, "upload_limit", None)
+            if config_key is not None:
+                return current_app.config[config_key]
+        return super(UploadRequest, self).max_content_length
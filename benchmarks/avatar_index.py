@@ -0,0 +1,80 @@
+"""Renders the index page with 25 posts and 10 replies each, once with the
+former glob() based avatar lookup and once with the avatar index."""
+import os
+import tempfile
+from glob import glob
+
+from bench_config import setup_app, teardown_app, login_client, stopwatch
+
+from app import avatars, session
+from app.logic import random_string
+from app.models import Post, User
+
+POSTS = 25
+REPLIES = 10
+USERS = 20
+RUNS = 20
+
+
+def populate(photo_path):
+    users = []
+    for i in range(USERS):
+        u = User(username="user{}".format(i), registration_code=random_string())
+        users.append(u)
+        if i % 2 == 0:
+            open(os.path.join(photo_path, u.registration_code + ".jpg"), "w").close()
+    session.add_all(users)
+    session.flush()
+    for i in range(POSTS):
+        post = Post(body="post {}".format(i), author=users[i % USERS])
+        session.add(post)
+        session.flush()
+        for j in range(REPLIES):
+            session.add(Post(body="reply {}".format(j), parent_id=post.id,
+                             author=users[(i + j) % USERS]))
+    session.commit()
+    return users[0].id
+
+
+def main():
+    app, app_context = setup_app()
+    with tempfile.TemporaryDirectory() as tmp:
+        photo_path = os.path.join(tmp, "static", "photos")
+        os.makedirs(photo_path)
+        avatars.photo_path = photo_path
+        avatars.invalidate()
+        client = login_client(app, populate(photo_path))
+
+        scans = {"count": 0}
+        index_lookup = avatars.lookup
+
+        def glob_lookup(registration_code):
+            scans["count"] += 1
+            result = glob(photo_path + "/*{}*".format(registration_code))
+            if len(result) == 1:
+                split = result[0].split(sep="/")
+                return "/%s/%s/%s" % (split[-3], split[-2], split[-1])
+            return None
+
+        avatars.lookup = glob_lookup
+        client.get("/index")
+        scans["count"] = 0
+        with stopwatch("glob() per avatar", RUNS):
+            for _ in range(RUNS):
+                client.get("/index")
+        print("{:<40} {:>10}".format("directory scans per page",
+                                     scans["count"] // RUNS))
+
+        avatars.lookup = index_lookup
+        client.get("/index")
+        before = avatars.scans
+        with stopwatch("avatar index", RUNS):
+            for _ in range(RUNS):
+                client.get("/index")
+        print("{:<40} {:>10}".format("directory scans per page",
+                                     (avatars.scans - before) // RUNS))
+    teardown_app(app_context)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Peak RSS and time to first byte of the backup export on a synthetic
+dataset with 100k posts and 10k invoices. Every mode runs in a separate
+process, so the peak RSS values don't influence each other."""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+from bench_config import BenchConfig, setup_app
+
+from app import db, session
+from app.models import Festival, Invoice, Post, User, participants, sharers
+
+POSTS = 100000
+INVOICES = 10000
+USERS = 50
+FESTIVALS = 20
+
+
+def populate():
+    now = datetime.utcnow()
+    session.execute(User.__table__.insert(), [{
+        "id": i, "username": "user{}".format(i),
+        "registration_code": "{:08d}".format(i), "access_level": 1,
+        "is_suspended": False, "water_demand": 1, "beer_demand": 1,
+        "mixed_demand": 1, "last_seen": now
+    } for i in range(1, USERS + 1)])
+    session.execute(Festival.__table__.insert(), [{
+        "id": i, "title": "festival{}".format(i), "creator_id": 1,
+        "is_closed": False, "update_info": "", "modified": now,
+        "start_date": date(2019, 8, 13), "end_date": date(2019, 8, 18)
+    } for i in range(1, FESTIVALS + 1)])
+    session.execute(participants.insert(), [{
+        "participant_id": u, "festival_id": f
+    } for f in range(1, FESTIVALS + 1) for u in range(1, USERS + 1)])
+    session.execute(Post.__table__.insert(), [{
+        "id": i, "body": "post body {} ".format(i) * 10, "user_id": i % USERS + 1,
+        "timestamp": now, "internal_time": now, "is_pinned": False
+    } for i in range(1, POSTS + 1)])
+    session.execute(Invoice.__table__.insert(), [{
+        "id": i, "title": "invoice{}".format(i), "amount_cents": i * 7,
+        "creditor_id": i % USERS + 1, "festival_id": i % FESTIVALS + 1
+    } for i in range(1, INVOICES + 1)])
+    session.execute(sharers.insert(), [{
+        "sharer_id": u, "invoice_id": i
+    } for i in range(1, INVOICES + 1) for u in range(1, 6)])
+    session.commit()
+
+
+def measure(mode):
+    from app.administration import backup_export
+    app, app_context = setup_app(DatabaseConfig)
+    with app.test_request_context():
+        start = time.perf_counter()
+        if mode == "stream":
+            body = iter(backup_export.stream_export().response)
+        else:
+            body = iter(backup_export.prepare_export().response)
+        first = next(body)
+        ttfb = time.perf_counter() - start
+        size = len(first)
+        for chunk in body:
+            size += len(chunk)
+        total = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("{:<10} ttfb {:>9.1f} ms  total {:>9.1f} ms  peak rss {:>7.1f} MB  {:>6.1f} MB"
+          .format(mode, ttfb * 1000, total * 1000, peak, size / 1024 / 1024))
+
+
+class DatabaseConfig(BenchConfig):
+    SQLALCHEMY_DATABASE_URI = os.environ.get("BENCH_DATABASE_URL")
+
+
+def main():
+    if len(sys.argv) > 1:
+        measure(sys.argv[1])
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = "sqlite:///" + os.path.join(tmp, "bench.db")
+        os.environ["BENCH_DATABASE_URL"] = db_url
+        DatabaseConfig.SQLALCHEMY_DATABASE_URI = db_url
+        app, app_context = setup_app(DatabaseConfig)
+        populate()
+        db.session.remove()
+        app_context.pop()
+        for mode in ("memory", "stream"):
+            subprocess.run([sys.executable, __file__, mode], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, basedir)
+
+from config import Config  # noqa E402
+from app import create_app, db  # noqa E402
+
+
+class BenchConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+
+
+def setup_app(config_class=BenchConfig):
+    app = create_app(config_class)
+    app_context = app.app_context()
+    app_context.push()
+    db.create_all()
+    return app, app_context
+
+
+def teardown_app(app_context):
+    db.session.remove()
+    db.drop_all()
+    app_context.pop()
+
+
+def login_client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["_user_id"] = str(user_id)
+        s["_fresh"] = True
+    return client
+
+
+@contextmanager
+def stopwatch(label, runs=1):
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    print("{:<40} {:>10.2f} ms".format(label, elapsed * 1000 / runs))
@@ -0,0 +1,40 @@
+"""Compares the settlement strategies on a festival with 200 participants."""
+import random
+from types import MappingProxyType
+
+from bench_config import stopwatch
+
+from app.festival.settlement import Ledger, strategies
+
+PARTICIPANTS = 200
+RUNS = 20
+
+
+def random_ledger(seed=42):
+    rnd = random.Random(seed)
+    participants = tuple(range(1, PARTICIPANTS + 1))
+    # integer cents, like the ledger of app.festival.settlement
+    balances = {p: rnd.randint(-15000, 15000) for p in participants}
+    # let the balances add up to zero like a real festival
+    balances[participants[-1]] = -sum(list(balances.values())[:-1])
+    partners = {}
+    for p in participants[:PARTICIPANTS // 4 * 2:2]:
+        partners[p] = p + 1
+        partners[p + 1] = p
+    return Ledger(festival_id=1,
+                  participants=participants,
+                  balances=MappingProxyType(balances),
+                  partners=MappingProxyType(partners))
+
+
+def main():
+    ledger = random_ledger()
+    for name, settle in strategies.items():
+        with stopwatch("{} settlement".format(name), RUNS):
+            for _ in range(RUNS):
+                transfers = settle(ledger)
+        print("{:<40} {:>10}".format("transfers", len(transfers)))
+
+
+if __name__ == "__main__":
+    main()
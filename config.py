@@ -29,6 +29,32 @@ class Config(object):
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # seconds to wait before a background job runs, jobs enqueued with the
+    # same key in the meantime are coalesced into a single run
+    JOB_QUEUE_DELAY = float(os.environ.get("JOB_QUEUE_DELAY") or 1.0)
+
+    # count SQL statements per request and log the ones slower than
+    # SLOW_QUERY_THRESHOLD seconds
+    SQL_INSTRUMENTATION = bool(os.environ.get("SQL_INSTRUMENTATION"))
+    SLOW_QUERY_THRESHOLD = float(os.environ.get("SLOW_QUERY_THRESHOLD") or 0.5)
+
+    # seconds between two recorded visits of a user, the visits are
+    # buffered and written every LAST_SEEN_FLUSH_INTERVAL seconds
+    LAST_SEEN_INTERVAL = int(os.environ.get("LAST_SEEN_INTERVAL") or 60)
+    LAST_SEEN_FLUSH_INTERVAL = float(os.environ.get("LAST_SEEN_FLUSH_INTERVAL") or 30)
+
+    # one thread per worker process checks the database for notifications
+    # of other worker processes every NOTIFICATION_POLL_INTERVAL seconds,
+    # notification streams end after NOTIFICATION_STREAM_TIMEOUT seconds
+    # and the browser reconnects
+    NOTIFICATION_POLL_INTERVAL = float(os.environ.get("NOTIFICATION_POLL_INTERVAL") or 15)
+    NOTIFICATION_STREAM_TIMEOUT = float(os.environ.get("NOTIFICATION_STREAM_TIMEOUT") or 300)
+    # each open stream or long poll holds a gunicorn thread, so keep this
+    # below the --threads of the Procfile; the difference serves the pages.
+    # Further clients fall back to polling, 0 removes the limit. See the
+    # README for the sizing
+    NOTIFICATION_MAX_STREAMS = int(os.environ.get("NOTIFICATION_MAX_STREAMS") or 112)
+
     PLATFORM = os.environ.get("PLATFORM")
 
     POSTS_PER_PAGE = 25
@@ -37,6 +63,9 @@ class Config(object):
 
     LANGUAGES = ["en", "de"]
 
+    # "greedy" or "legacy", see app.festival.settlement
+    SETTLEMENT_STRATEGY = os.environ.get("SETTLEMENT_STRATEGY") or "greedy"
+
     STATIC_DIR = os.path.join(basedir,
                               "app",
                               "static")
@@ -44,6 +73,13 @@ class Config(object):
     UPLOADED_PHOTOS_DEST = os.path.join(STATIC_DIR, "photos")
     UPLOADED_BACKUPS_DEST = os.path.join(STATIC_DIR, "backups")
     UPLOADED_ARCHIVES_DEST = os.path.join(STATIC_DIR, "archives")
+    # backup uploads are streamed by the importer, so they may be larger
+    # than MAX_CONTENT_LENGTH
+    MAX_BACKUP_LENGTH = int(os.environ.get("MAX_BACKUP_LENGTH") or 1024 * 1024 * 1024)
+    # a delta backup reads the changes of this many seconds before its
+    # "since" again, which a transaction committed after the previous
+    # backup might have stamped earlier
+    BACKUP_DELTA_OVERLAP = int(os.environ.get("BACKUP_DELTA_OVERLAP") or 300)
 
     # chronicle >>
     MAX_CONTENT_LENGTH = 1024 * 1024
@@ -58,4 +94,11 @@ class Config(object):
 
     SHOPPING_LIST_PATH = os.path.join(STATIC_DIR, "shopping_lists")
 
+    # seconds until cached reference data (PKU, open festivals) is reloaded,
+    # so changes made in other worker processes show up; 0 never expires
+    REFERENCE_CACHE_TTL = float(os.environ.get("REFERENCE_CACHE_TTL") or 60)
+
+    # bytes of rendered documents kept in memory, 0 disables the cache
+    RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE") or 8 * 1024 * 1024)
+
     # << export shoppinglist
@@ -0,0 +1,35 @@
+"""amounts in cents
+
+Revision ID: 3f2b8c71d9e4
+Revises: 670e283b7bae
+Create Date: 2026-10-18 14:12:03.512730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2b8c71d9e4'
+down_revision = '670e283b7bae'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('invoice', 'transfer'):
+        op.add_column(table, sa.Column('amount_cents', sa.Integer(), nullable=True))
+        op.execute("UPDATE {} SET amount_cents = ROUND(amount * 100)".format(table))
+        op.execute("UPDATE {} SET amount_cents = 0 WHERE amount_cents IS NULL".format(table))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('amount_cents', existing_type=sa.Integer(),
+                                  nullable=False)
+            batch_op.drop_column('amount')
+
+
+def downgrade():
+    for table in ('invoice', 'transfer'):
+        op.add_column(table, sa.Column('amount', sa.Float(), nullable=True))
+        op.execute("UPDATE {} SET amount = amount_cents / 100.0".format(table))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('amount_cents')
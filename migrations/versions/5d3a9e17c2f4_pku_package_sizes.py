@@ -0,0 +1,31 @@
+"""pku package sizes
+
+Revision ID: 5d3a9e17c2f4
+Revises: 8c41d7e2a9b6
+Create Date: 2026-10-18 19:12:44.102938
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d3a9e17c2f4'
+down_revision = '8c41d7e2a9b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('packaging_unit_type',
+                  sa.Column('package_sizes', sa.String(length=30), nullable=True))
+    # the pallet sizes which used to be hardcoded in the drink calculation
+    pku = sa.table('packaging_unit_type', sa.column('internal_name'),
+                   sa.column('package_sizes'))
+    op.execute(pku.update().where(pku.c.internal_name == 'Cans')
+               .values(package_sizes='24,18'))
+
+
+def downgrade():
+    with op.batch_alter_table('packaging_unit_type') as batch_op:
+        batch_op.drop_column('package_sizes')
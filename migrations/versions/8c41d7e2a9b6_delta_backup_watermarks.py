@@ -0,0 +1,48 @@
+"""delta backup watermarks
+
+Revision ID: 8c41d7e2a9b6
+Revises: 3f2b8c71d9e4
+Create Date: 2026-10-18 16:40:27.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41d7e2a9b6'
+down_revision = '3f2b8c71d9e4'
+branch_labels = None
+depends_on = None
+
+tables = ('user', 'post', 'invoice', 'transfer', 'consumption_item',
+          'packaging_unit_type', 'utility_item', 'chronicle_entry')
+
+
+def upgrade():
+    op.create_table('tombstone',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('table_name', sa.String(length=50), nullable=False),
+                    sa.Column('row_id', sa.Integer(), nullable=False),
+                    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index(op.f('ix_tombstone_deleted_at'), 'tombstone', ['deleted_at'],
+                    unique=False)
+    for table in tables:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute(sa.table(table, sa.column('updated_at')).update()
+                   .values(updated_at=sa.func.now()))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(),
+                                  nullable=False)
+            batch_op.create_index(op.f('ix_{}_updated_at'.format(table)),
+                                  ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in tables:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_index(op.f('ix_{}_updated_at'.format(table)))
+            batch_op.drop_column('updated_at')
+    op.drop_index(op.f('ix_tombstone_deleted_at'), table_name='tombstone')
+    op.drop_table('tombstone')
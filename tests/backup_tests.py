@@ -0,0 +1,314 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+from io import BytesIO
+from zipfile import ZipFile
+
+from flask import get_flashed_messages, request
+from sqlalchemy import event
+
+from app import db, image_store, last_seen_buffer, session
+from app.administration import backup_export, backup_import
+from app.administration.backup_reader import BackupReader
+from app.containers import UserAccessLevel
+from app.models import Festival, Invoice, Post, User
+from config import Config
+from festival_tests import setup_complex_costallocation
+from test_config import BaseTestCase
+
+
+class BackupExportTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(BackupExportTestCase, self).setUp()
+        setup_complex_costallocation()
+        users = session.query(User).all()
+        users[0].access_level = UserAccessLevel.OWNER
+        for i in range(25):
+            db.session.add(Post(body="post {}".format(i),
+                                author=users[i % len(users)]))
+        db.session.commit()
+
+    def test_stream_export(self):
+        chunk_size = backup_export.EXPORT_CHUNK_SIZE
+        backup_export.EXPORT_CHUNK_SIZE = 4
+        try:
+            with self.app.test_request_context():
+                expected = json.loads(backup_export.prepare_export().get_data())
+                response = backup_export.stream_export()
+                self.assertTrue(response.is_streamed)
+                streamed = json.loads(response.get_data())
+        finally:
+            backup_export.EXPORT_CHUNK_SIZE = chunk_size
+        del expected["until"], streamed["until"]
+        self.assertEqual(expected, streamed)
+        self.assertEqual(25, len(streamed["posts"]))
+        self.assertEqual(10, len(streamed["festivals"][0]["participants"]))
+
+    def __count_export_statements(self):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            with self.app.test_request_context():
+                backup_export.prepare_export()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        return len(statements)
+
+    def test_export_query_count(self):
+        few_rows = self.__count_export_statements()
+
+        users = session.query(User).all()
+        for i in range(10):
+            festival = Festival(title="Festival{}".format(i + 2), creator=users[0],
+                                start_date=date(2020, 8, 13),
+                                end_date=date(2020, 8, 18))
+            db.session.add(festival)
+            invoice = Invoice(title="Invoice{}".format(i), amount=10.0,
+                              creditor=users[0], festival=festival)
+            db.session.add(invoice)
+            for u in users:
+                festival.join(u)
+                invoice.add_sharer(u)
+        db.session.commit()
+
+        self.assertEqual(few_rows, self.__count_export_statements())
+
+    def test_failed_import_rolls_back(self):
+        with self.app.test_request_context():
+            data = json.loads(backup_export.prepare_export().get_data())
+            # a duplicate primary key lets the import fail after the deletion
+            data["posts"].append(dict(data["posts"][0]))
+            backup = BytesIO(json.dumps(data).encode("utf-8"))
+            self.assertFalse(backup_import.load_backup(backup))
+
+        self.assertEqual(10, session.query(User).count())
+        self.assertEqual(25, session.query(Post).count())
+        self.assertEqual(len(data["invoices"]), session.query(Invoice).count())
+        festival = session.query(Festival).first()
+        self.assertEqual(10, festival.participants.count())
+
+    def test_import_roundtrip(self):
+        with self.app.test_request_context():
+            expected = json.loads(backup_export.prepare_export().get_data())
+            backup = BytesIO(json.dumps(expected).encode("utf-8"))
+            self.assertTrue(backup_import.load_backup(backup))
+            imported = json.loads(backup_export.prepare_export().get_data())
+        del expected["until"], imported["until"]
+        self.assertEqual(expected, imported)
+
+    def test_delta_backup(self):
+        self.app.config["BACKUP_DELTA_OVERLAP"] = 0
+        with self.app.test_request_context():
+            base = backup_export.prepare_export().get_data()
+        users = session.query(User).all()
+        invoice = session.query(Invoice).first()
+        invoice.remove_sharer(users[1])
+        session.delete(session.query(Post).first())
+        session.add(Post(body="new post", author=users[2]))
+        session.commit()
+
+        with self.app.test_request_context():
+            since = datetime.fromisoformat(json.loads(base)["until"])
+            delta = json.loads(backup_export.prepare_delta_export(since).get_data())
+            expected = json.loads(backup_export.prepare_export().get_data())
+        self.assertEqual(["new post"], [p["body"] for p in delta["posts"]])
+        self.assertEqual([invoice.id], [i["id"] for i in delta["invoices"]])
+        self.assertEqual({"post": [1]}, delta["deleted"])
+        self.assertEqual([], delta["festivals"])
+
+        with self.app.test_request_context():
+            self.assertTrue(backup_import.load_backup(
+                BytesIO(base), [BytesIO(json.dumps(delta).encode("utf-8"))]))
+            imported = json.loads(backup_export.prepare_export().get_data())
+            # the delta has to continue where the base ended
+            delta["since"] = delta["until"]
+            self.assertFalse(backup_import.load_backup(
+                BytesIO(base), [BytesIO(json.dumps(delta).encode("utf-8"))]))
+        del expected["until"], imported["until"]
+        self.assertEqual(expected, imported)
+
+    def test_delta_backup_overlap(self):
+        with self.app.test_request_context():
+            since = datetime.fromisoformat(
+                json.loads(backup_export.prepare_export().get_data())["until"])
+        # stamped before the base was taken, but committed after it
+        post = session.query(Post).first()
+        post.body = "late post"
+        post.updated_at = since - timedelta(seconds=10)
+        session.commit()
+
+        with self.app.test_request_context():
+            delta = json.loads(backup_export.prepare_delta_export(since).get_data())
+            self.app.config["BACKUP_DELTA_OVERLAP"] = 0
+            strict = json.loads(backup_export.prepare_delta_export(since).get_data())
+        self.assertIn("late post", [p["body"] for p in delta["posts"]])
+        self.assertEqual(since.isoformat(), delta["since"])
+        self.assertEqual([], strict["posts"])
+
+    def test_visit_is_no_change(self):
+        self.app.config["BACKUP_DELTA_OVERLAP"] = 0
+        user = session.query(User).first()
+        user_id, updated_at = user.id, user.updated_at
+        since = datetime.utcnow()
+        last_seen_buffer.record(user_id, since + timedelta(seconds=1))
+        last_seen_buffer.flush()
+
+        self.assertEqual(updated_at, session.query(User.updated_at)
+                         .filter_by(id=user_id).scalar())
+        with self.app.test_request_context():
+            delta = json.loads(backup_export.prepare_delta_export(since).get_data())
+        self.assertEqual([], delta["users"])
+
+    def test_archive_roundtrip(self):
+        with self.app.test_request_context():
+            expected = json.loads(backup_export.prepare_export().get_data())
+            archive = backup_export.stream_archive().get_data()
+        with ZipFile(BytesIO(archive)) as zip_file:
+            toc = json.loads(zip_file.read(backup_export.ARCHIVE_TOC))
+        self.assertEqual(25, toc["tables"]["posts"]["rows"])
+
+        session.query(Post).filter(Post.id > 20).delete()
+        session.query(Invoice).first().title = "changed"
+        session.commit()
+        with self.app.test_request_context():
+            # only the posts are restored, the invoice keeps its change
+            self.assertTrue(backup_import.load_archive(BytesIO(archive), {"posts"}))
+        self.assertEqual(25, session.query(Post).count())
+        self.assertEqual("changed", session.query(Invoice).first().title)
+
+        with self.app.test_request_context():
+            self.assertTrue(backup_import.load_archive(BytesIO(archive)))
+            imported = json.loads(backup_export.prepare_export().get_data())
+        del expected["until"], imported["until"]
+        self.assertEqual(expected, imported)
+
+    def test_import_checks_version_first(self):
+        # the sections after a wrong version number are never parsed
+        backup = BytesIO(b'{"version_number": "0000", "users": [{"id": ')
+        with self.app.test_request_context():
+            self.assertFalse(backup_import.load_backup(backup))
+            self.assertEqual(["Invalid version number"], get_flashed_messages())
+        self.assertEqual(10, session.query(User).count())
+
+
+class BackupReaderTestCase(BaseTestCase):
+
+    class CountingFile(BytesIO):
+        reads = 0
+
+        def read(self, *args):
+            self.reads += 1
+            return super().read(*args)
+
+    def test_malformed_document_fails_early(self):
+        document = b'{"users": [{"id": 1 "name": "x"}' + b' ' * 100000 + b']}'
+        file = self.CountingFile(document)
+        reader = BackupReader(file, read_size=64)
+        with self.assertRaises(ValueError):
+            for _ in reader.members():
+                list(reader.items())
+        self.assertLess(file.reads, 5)
+
+    def test_large_value(self):
+        body = "x" * 100000
+        file = self.CountingFile(json.dumps({"posts": [{"body": body}]}).encode("utf-8"))
+        reader = BackupReader(file, read_size=64)
+        for _ in reader.members():
+            self.assertEqual([{"body": body}], list(reader.items()))
+        # the read size grows with the pending value
+        self.assertLess(file.reads, 20)
+
+        reader = BackupReader(BytesIO(file.getvalue()), read_size=64, max_value_size=1000)
+        with self.assertRaises(ValueError):
+            for _ in reader.members():
+                list(reader.items())
+
+
+class BackupUploadTestCase(BaseTestCase):
+
+    def test_backup_upload_limit(self):
+        with self.app.test_request_context("/administration/import_backup", method="POST"):
+            self.assertEqual(self.app.config["MAX_BACKUP_LENGTH"], request.max_content_length)
+        with self.app.test_request_context("/chronicle/", method="POST"):
+            self.assertEqual(self.app.config["MAX_CONTENT_LENGTH"], request.max_content_length)
+
+
+class ImageBackupTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(ImageBackupTestCase, self).setUp()
+        self.upload_path = tempfile.mkdtemp()
+        self.config_path = Config.UPLOAD_PATH
+        Config.UPLOAD_PATH = self.upload_path
+        image_store.upload_path = self.upload_path
+        image_store.manifest_path = os.path.join(self.upload_path, "manifest.json")
+
+    def tearDown(self):
+        Config.UPLOAD_PATH = self.config_path
+        image_store.init_app(self.app)
+        shutil.rmtree(self.upload_path)
+        super(ImageBackupTestCase, self).tearDown()
+
+    def __add_image(self, path, content):
+        file_path = os.path.join(self.upload_path, path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as file:
+            file.write(content)
+        return image_store.add(file_path)
+
+    def __add_images(self, directory):
+        for i in range(20):
+            self.__add_image("{}/{}.jpg".format(directory, i),
+                             "{}-{}".format(directory, i).encode("utf-8"))
+
+    def test_concurrent_processes(self):
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=self.__add_images, args=(d,))
+                   for d in ("1", "2", "3")]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        self.assertEqual(60, len(image_store.snapshot()[1]))
+
+    def __download(self, since=0):
+        with self.app.test_request_context():
+            return backup_export.zip_and_download_images(since).get_data()
+
+    def test_incremental_image_backup(self):
+        digest = self.__add_image("1/1/a.jpg", b"first")
+        self.__add_image("1/2/b.jpg", b"first")
+        base = self.__download()
+        with ZipFile(BytesIO(base)) as zip_file:
+            manifest = json.loads(zip_file.read(backup_export.IMAGE_MANIFEST))
+            self.assertEqual(["objects/{}.jpg".format(digest)],
+                             [n for n in zip_file.namelist() if n.startswith("objects/")])
+        self.assertEqual(["1/1/a.jpg", "1/2/b.jpg"], manifest["objects"][digest])
+
+        self.__add_image("2/1/c.png", b"second")
+        delta = self.__download(manifest["serial"])
+        with ZipFile(BytesIO(delta)) as zip_file:
+            self.assertEqual(2, len(zip_file.namelist()))
+
+        # the delta only restores with the images of the base
+        shutil.rmtree(os.path.join(self.upload_path, "2"))
+        os.remove(os.path.join(self.upload_path, "1/1/a.jpg"))
+        image_store.rebuild()
+        backup_import.load_images(BytesIO(delta))
+        for path, content in (("1/1/a.jpg", b"first"), ("1/2/b.jpg", b"first"),
+                              ("2/1/c.png", b"second")):
+            with open(os.path.join(self.upload_path, path), "rb") as file:
+                self.assertEqual(content, file.read())
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
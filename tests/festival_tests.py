@@ -1,11 +1,14 @@
-from datetime import date
+from datetime import date, datetime, timedelta
 
-from app import db, session
+from sqlalchemy import event
+
+from app import db, jobs, last_seen_buffer, session
 from app.logic import random_string
 from app.containers import FestivalUpdateInfo
 from app.logic import notify_users
 from app.festival.logic import calculate_shares, \
-    calculate_transfers, reopen_festival, load_participants_from_db
+    calculate_transfers, reopen_festival
+from app.festival.settlement import strategies
 from app.models import User, Festival, Invoice, Transfer, \
     Notification
 
@@ -132,6 +135,39 @@ class FestivalModelTestCase(BaseTestCase):
         # -1, since there is no notification for the creator
         self.assertEqual(len(notifications), len(users) - 1)
 
+    def test_notification_payload(self):
+        setup_base_costallocation()
+        u2 = session.query(User).filter_by(username="user2").first()
+        u2.last_seen = datetime.utcnow() + timedelta(days=1)
+        db.session.commit()
+        u1 = session.query(User).filter_by(username="user1").first()
+        u3 = session.query(User).filter_by(username="user3").first()
+        notify_users(u1.id)
+
+        notifications = session.query(Notification).all()
+        self.assertEqual(2, len(notifications))
+        payloads = {n.user_id: n.get_data() for n in notifications}
+        self.assertEqual(0, payloads[u2.id])
+        self.assertEqual(1, payloads[u3.id])
+
+    def test_notification_payload_buffered_visit(self):
+        setup_base_costallocation()
+        u1 = session.query(User).filter_by(username="user1").first()
+        u2 = session.query(User).filter_by(username="user2").first()
+        u1_id, u2_id = u1.id, u2.id
+        jobs.inline = False
+        try:
+            # the visit is still waiting in the buffer
+            last_seen_buffer.record(u2_id, datetime.utcnow() + timedelta(days=1))
+            notify_users(u1_id)
+            jobs.drain()
+        finally:
+            jobs.inline = True
+
+        payloads = {n.user_id: n.get_data() for n in session.query(Notification)}
+        self.assertEqual(0, payloads[u2_id])
+        self.assertIsNone(last_seen_buffer.get(u2_id))
+
     def test_base_costallocation(self):
         setup_base_costallocation()
 
@@ -142,17 +178,16 @@ class FestivalModelTestCase(BaseTestCase):
         users = session.query(User).all()
         self.assertEqual(3, len(users))
 
-        calculate_shares(festival)
+        ledger = calculate_shares(festival)
 
         for u in users:
-            self.assertNotEqual(0.0, u.dept)
-        payers = list(filter(lambda u: u.dept > 0, users))
-        receivers = list(filter(lambda u: u.dept < 0, users))
+            self.assertNotEqual(0.0, ledger.balance(u.id))
+        payers = list(filter(lambda u: ledger.balance(u.id) > 0, users))
+        receivers = list(filter(lambda u: ledger.balance(u.id) < 0, users))
         self.assertEqual(2, len(payers))
         self.assertEqual(1, len(receivers))
 
-        participants = load_participants_from_db(festival.id)
-        calculate_transfers(festival, participants)
+        calculate_transfers(festival, ledger)
         transfers = session.query(Transfer).all()
         self.assertEqual(2, len(transfers))
 
@@ -164,15 +199,14 @@ class FestivalModelTestCase(BaseTestCase):
 
         users = session.query(User).all()
         self.assertEqual(10, len(users))
-        calculate_shares(festival)
+        ledger = calculate_shares(festival)
 
-        payers = list(filter(lambda u: u.dept > 0, users))
-        receivers = list(filter(lambda u: u.dept < 0, users))
+        payers = list(filter(lambda u: ledger.balance(u.id) > 0, users))
+        receivers = list(filter(lambda u: ledger.balance(u.id) < 0, users))
         self.assertEqual(7, len(payers))
         self.assertEqual(3, len(receivers))
 
-        participants = load_participants_from_db(festival.id)
-        calculate_transfers(festival, participants)
+        calculate_transfers(festival, ledger)
         transfers = session.query(Transfer).all()
         self.assertEqual(9, len(transfers))
         invoices = list(map(lambda p: p.amount, session.query(Invoice).all()))
@@ -184,6 +218,51 @@ class FestivalModelTestCase(BaseTestCase):
         overall_transfer = sum(repayments)
         self.assertLessEqual(required_repayment_amount, overall_transfer)
 
+    def test_ledger_query_count(self):
+        setup_complex_costallocation()
+        festival = session.query(Festival).first()
+        for i in range(20):
+            db.session.add(Invoice(title="Extra {}".format(i), amount=10.0,
+                                   creditor_id=1, festival=festival))
+        db.session.commit()
+        festival = session.query(Festival).first()
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            ledger = calculate_shares(festival)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertLessEqual(len(statements), 3)
+        self.assertEqual(10, len(ledger.participants))
+        with self.assertRaises(TypeError):
+            ledger.balances[1] = 0.0
+
+    def test_settlement_strategies(self):
+        setup_complex_costallocation()
+        festival = session.query(Festival).first()
+        ledger = calculate_shares(festival)
+
+        for name, settle in strategies.items():
+            transfers = settle(ledger)
+            self.assertLessEqual(len(transfers), len(ledger.participants) - 1)
+            paid = {}
+            for payer, recipient, cents in transfers:
+                self.assertGreater(cents, 0)
+                paid[payer] = paid.get(payer, 0) + cents
+            for p in ledger.payers():
+                self.assertEqual(ledger.balance(p), paid[p], name)
+
+        # partners settle among themselves first
+        mj = session.query(User).filter_by(username="MJ").first()
+        greedy = strategies["greedy"](ledger)
+        self.assertIn(mj.id, [payer for payer, recipient, _ in greedy
+                              if recipient == mj.partner_id])
+
     def test_reopen_festival(self):
         setup_complex_costallocation()
 
@@ -192,15 +271,14 @@ class FestivalModelTestCase(BaseTestCase):
 
         users = session.query(User).all()
         self.assertEqual(10, len(users))
-        calculate_shares(festival)
+        ledger = calculate_shares(festival)
 
-        payers = list(filter(lambda u: u.dept > 0, users))
-        receivers = list(filter(lambda u: u.dept < 0, users))
+        payers = list(filter(lambda u: ledger.balance(u.id) > 0, users))
+        receivers = list(filter(lambda u: ledger.balance(u.id) < 0, users))
         self.assertEqual(7, len(payers))
         self.assertEqual(3, len(receivers))
 
-        participants = load_participants_from_db(festival.id)
-        calculate_transfers(festival, participants)
+        calculate_transfers(festival, ledger)
         transfers = session.query(Transfer).all()
         self.assertEqual(9, len(transfers))
 
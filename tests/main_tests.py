@@ -1,11 +1,22 @@
+import json
 import os
+import tempfile
+import threading
+from datetime import date, datetime
+from time import time
 
 from hashlib import md5
 import unittest
 
-from app import db, session
+from sqlalchemy import event
+
+from app import avatars, db, jobs, last_seen_buffer, notification_hub, query_stats, \
+    session
+from app.containers import NotificationType
 from app.containers import UserAccessLevel
-from app.models import User
+from app.jobs import JobQueue
+from app.main.utils import send_attachment
+from app.models import Festival, Notification, Post, User
 from test_config import BaseTestCase
 
 
@@ -44,6 +55,370 @@ class UserModelCase(BaseTestCase):
             ("https://www.gravatar.com/avatar/{}?d=identicon&s=128").format(
                 avatar_url))
 
+    def test_avatar_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            photo_path = os.path.join(tmp, "static", "photos")
+            os.makedirs(photo_path)
+            photo = os.path.join(photo_path, "93c191CC.jpg")
+            open(photo, "w").close()
+            avatars.photo_path = photo_path
+            avatars.invalidate()
+            self.addCleanup(avatars.init_app, self.app)
+
+            u = User(username="john", registration_code="93c191CC")
+            scans = avatars.scans
+            for _ in range(10):
+                self.assertEqual("/static/photos/93c191CC.jpg", u.avatar(40))
+            self.assertEqual(scans + 1, avatars.scans)
+
+            os.remove(photo)
+            avatars.remove(u.registration_code)
+            self.assertTrue(u.avatar(40).startswith("https://www.gravatar.com"))
+
+    def test_job_queue_coalescing(self):
+        # without init_app there is no worker thread, drain() runs the jobs
+        queue = JobQueue()
+        queue.app = self.app
+        queue.inline = False
+        queue.delay = 60
+        calls = []
+        for i in range(10):
+            queue.enqueue(calls.append, i, key="edit")
+        self.assertEqual([], calls)
+        queue.drain()
+        self.assertEqual([9], calls)
+
+    def test_send_attachment(self):
+        content = b"PK\x03\x04\nline\r\n" * 1000
+        response = send_attachment(content, "list.docx", "text/docx")
+        self.assertEqual(len(content), response.content_length)
+        self.assertEqual(content, response.get_data())
+        self.assertIn("filename=list.docx", response.headers["Content-Disposition"])
+
+        response = send_attachment(iter([content, content]), "images.zip",
+                                   "application/zip")
+        self.assertTrue(response.is_streamed)
+        self.assertIsNone(response.content_length)
+        self.assertEqual(content * 2, response.get_data())
+
+    def __add_posts(self, users, number, replies):
+        for i in range(number):
+            post = Post(body="post {}".format(i), author=users[i % len(users)])
+            db.session.add(post)
+            db.session.flush()
+            for j in range(replies):
+                db.session.add(Post(body="reply {}".format(j), parent_id=post.id,
+                                    author=users[j % len(users)]))
+        db.session.commit()
+
+    def __count_statements(self, client, url):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        # every request starts with a fresh session in production
+        db.session.remove()
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            response = client.get(url)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertEqual(200, response.status_code)
+        return len(statements)
+
+    def test_index_query_count(self):
+        users = [User(username="user{}".format(i),
+                      registration_code="code{}".format(i)) for i in range(5)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.__add_posts(users, 2, 2)
+
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s["_user_id"] = str(users[0].id)
+            s["_fresh"] = True
+
+        few_posts = self.__count_statements(client, "/index")
+        self.__add_posts(users, 23, 10)
+        many_posts = self.__count_statements(client, "/index")
+        self.assertEqual(few_posts, many_posts)
+        self.assertLessEqual(many_posts, 10)
+
+    def test_navbar_badges_and_last_seen(self):
+        owner = User(username="owner", registration_code="93c191CC",
+                     access_level=UserAccessLevel.OWNER,
+                     last_seen=datetime(2020, 1, 1))
+        db.session.add(owner)
+        db.session.add(Festival(title="Wacken", creator=owner,
+                                start_date=date(2020, 8, 1), end_date=date(2020, 8, 5)))
+        db.session.commit()
+
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s["_user_id"] = str(owner.id)
+            s["_fresh"] = True
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        badge = r'id="festival_count"[^>]*visibility: {}\s*;">\s*{}\s*<'
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            first = client.get("/index").get_data(as_text=True)
+            db.session.add(Festival(title="Summer Breeze", creator=owner,
+                                    start_date=date(2020, 8, 12),
+                                    end_date=date(2020, 8, 15)))
+            db.session.commit()
+            second = client.get("/index").get_data(as_text=True)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+
+        self.assertEqual(1, len([s for s in statements if s.startswith("UPDATE user")]))
+        badge_queries = [s for s in statements if "FROM registration" in s]
+        self.assertEqual(2, len(badge_queries))
+        self.assertIn("FROM festival", badge_queries[0])
+        self.assertIn("FROM notification", badge_queries[0])
+        # the badge counts the changes since current_user.last_seen, which
+        # is the visit recorded by the request itself
+        self.assertRegex(first, badge.format("hidden", 0))
+        # the second visit falls into LAST_SEEN_INTERVAL and isn't recorded
+        self.assertRegex(second, badge.format("visible", 1))
+
+    def test_last_seen_write_behind(self):
+        users = [User(username="user{}".format(i), registration_code="code{}".format(i),
+                      last_seen=datetime(2020, 1, 1)) for i in range(3)]
+        users[2].last_seen = datetime(2021, 1, 1)
+        db.session.add_all(users)
+        db.session.commit()
+
+        jobs.inline = False
+        try:
+            user_ids = [u.id for u in users]
+            for user_id in user_ids:
+                last_seen_buffer.record(user_id, datetime(2020, 6, 1))
+            last_seen_buffer.record(user_ids[0], datetime(2020, 7, 1))
+            last_seen_buffer.record(user_ids[0], datetime(2020, 3, 1))
+            self.assertEqual(datetime(2020, 1, 1),
+                             session.query(User.last_seen).filter_by(id=user_ids[0]).scalar())
+
+            statements = []
+
+            def count(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                jobs.drain()
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+        finally:
+            jobs.inline = True
+
+        self.assertEqual(1, len([s for s in statements if s.startswith("UPDATE user")]))
+        # a newer timestamp in the database is kept
+        self.assertEqual([datetime(2020, 7, 1), datetime(2020, 6, 1), datetime(2021, 1, 1)],
+                         [s for s, in session.query(User.last_seen).order_by(User.id)])
+        self.assertIsNone(last_seen_buffer.get(user_ids[0]))
+
+    def test_notification_hub(self):
+        user = User(username="user", registration_code="code")
+        db.session.add(user)
+        db.session.commit()
+
+        with notification_hub.subscribe(user.id) as subscription:
+            user.add_notification(NotificationType.admin, 1)
+            db.session.rollback()
+            user.add_notification(NotificationType.admin, 2)
+            self.assertEqual([], subscription.wait(0))
+            db.session.commit()
+            self.assertEqual([2], [n["data"] for n in subscription.wait(0)])
+        self.assertEqual({}, notification_hub._subscriptions)
+
+    def test_notification_stream(self):
+        notification_hub.poll_interval = 0.05
+        notification_hub.stream_timeout = 0.1
+        user = User(username="user", registration_code="code")
+        db.session.add(user)
+        db.session.commit()
+        user.add_notification(NotificationType.admin, 3)
+        db.session.commit()
+
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s["_user_id"] = str(user.id)
+            s["_fresh"] = True
+        response = client.get("/notifications/stream")
+        self.assertEqual("text/event-stream", response.mimetype)
+        events = [e for e in response.get_data(as_text=True).split("\n\n")
+                  if e.startswith("id:")]
+        self.assertEqual(1, len(events))
+        event_id, data = events[0].split("\n")
+        self.assertEqual([3], [n["data"] for n in json.loads(data[len("data: "):])])
+
+        # long polling continues after the last notification
+        since = event_id[len("id: "):]
+        response = client.get("/notifications?wait=0.1&since=" + since)
+        self.assertEqual([], response.get_json())
+        response = client.get("/notifications?since=0")
+        self.assertEqual(1, len(response.get_json()))
+
+    def test_notification_poller(self):
+        users = [User(username="user{}".format(i), registration_code="code{}".format(i))
+                 for i in range(2)]
+        db.session.add_all(users)
+        db.session.commit()
+        user_ids = [u.id for u in users]
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with notification_hub.subscribe(user_ids[0]) as first, \
+                notification_hub.subscribe(user_ids[1]) as second:
+            # added by another worker process, the hub doesn't see the commit
+            session.execute(Notification.__table__.insert(), [
+                {"name": NotificationType.admin, "user_id": user_id,
+                 "payload_json": json.dumps(i + 1), "timestamp": time() + i}
+                for i, user_id in enumerate(user_ids)])
+            session.commit()
+
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                notification_hub.poll()
+                notification_hub.poll()
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+            self.assertEqual([1], [n["data"] for n in first.wait(0)])
+            self.assertEqual([2], [n["data"] for n in second.wait(0)])
+
+        self.assertEqual(2, len(statements))
+        self.assertTrue(all("FROM notification" in s for s in statements))
+
+        # without subscriptions there is nothing to poll for
+        statements.clear()
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            notification_hub.poll()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertEqual([], statements)
+
+    def test_notification_stream_limit(self):
+        user = User(username="user", registration_code="code")
+        db.session.add(user)
+        db.session.commit()
+        user.add_notification(NotificationType.admin, 3)
+        db.session.commit()
+
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s["_user_id"] = str(user.id)
+            s["_fresh"] = True
+        notification_hub.max_streams = 1
+        notification_hub.poll_interval = 15
+        with notification_hub.subscribe(user.id):
+            response = client.get("/notifications/stream")
+            self.assertEqual(503, response.status_code)
+            self.assertEqual("15", response.headers["Retry-After"])
+
+            # long polling returns at once instead of holding the thread
+            response = client.get("/notifications?wait=60&since=0")
+            self.assertEqual([3], [n["data"] for n in response.get_json()])
+            self.assertEqual("15", response.headers["Retry-After"])
+
+        # a stream closed before its first chunk frees its place
+        response = client.get("/notifications/stream")
+        self.assertEqual(200, response.status_code)
+        response.close()
+        with notification_hub.try_subscribe(user.id) as subscription:
+            self.assertIsNotNone(subscription)
+
+    def test_notification_hub_limit_is_atomic(self):
+        notification_hub.max_streams = 5
+        barrier = threading.Barrier(20)
+        subscriptions = []
+
+        def subscribe():
+            barrier.wait()
+            subscriptions.append(notification_hub.try_subscribe(1))
+
+        threads = [threading.Thread(target=subscribe) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        opened = [s for s in subscriptions if s is not None]
+        self.assertEqual(5, len(opened))
+        for subscription in opened:
+            notification_hub.unsubscribe(subscription)
+            notification_hub.unsubscribe(subscription)
+        with notification_hub.try_subscribe(1) as subscription:
+            self.assertIsNotNone(subscription)
+
+    def test_notification_poller_late_commit(self):
+        user = User(username="user", registration_code="code")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        table = Notification.__table__
+
+        with notification_hub.subscribe(user_id) as subscription:
+            polled = time()
+            session.execute(table.insert(), [{
+                "name": NotificationType.admin, "user_id": user_id,
+                "payload_json": "1", "timestamp": polled}])
+            session.commit()
+            notification_hub.poll()
+            self.assertEqual([1], [n["data"] for n in subscription.wait(0)])
+
+            # stamped before the last poll, but committed after it
+            session.execute(table.insert(), [{
+                "name": NotificationType.festival_updated, "user_id": user_id,
+                "payload_json": "2", "timestamp": polled - 1}])
+            session.commit()
+            notification_hub.poll()
+            self.assertEqual([2], [n["data"] for n in subscription.wait(0)])
+
+            # every notification is delivered once
+            notification_hub.poll()
+            self.assertEqual([], subscription.wait(0))
+
+    def test_query_stats(self):
+        self.app.config["SQL_INSTRUMENTATION"] = True
+        query_stats.init_app(self.app)
+        # a second init must not count every statement twice
+        query_stats.init_app(self.app)
+        owner = User(username="owner", registration_code="93c191CC",
+                     access_level=UserAccessLevel.OWNER)
+        db.session.add(owner)
+        db.session.commit()
+
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s["_user_id"] = str(owner.id)
+            s["_fresh"] = True
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            response = client.get("/index")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        timings = response.headers.getlist("Server-Timing")
+        self.assertEqual(1, len(timings))
+        self.assertIn("db;dur=", timings[0])
+
+        stats = client.get("/administration/query_stats").get_json()
+        index = [e for e in stats if e["endpoint"] == "main.index"][0]
+        self.assertEqual(1, index["requests"])
+        self.assertEqual(len(statements), index["queries"])
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -1,12 +1,19 @@
+import time
 from datetime import date
-from sqlalchemy import or_
+from io import BytesIO
 
-from app import db, session
-from app.logic import create_festival, create_user, create_pku
+from docx import Document
+from sqlalchemy import event, or_
+
+from app import db, docx_cache, reference_cache, session
+from app.logic import create_festival, create_user, create_pku, \
+    invalidate_pku_references
+from app.purchase.planning import best_mix, load_demand, plan_drinks
 from app.containers import UserAccessLevel, ConsumptionItemState
 from app.purchase.logic import check_shopping_empty, \
-    generate_shopping_list
-from app.models import ConsumptionItem, PackagingUnitType
+    export_and_download_docx, generate_shopping_list, get_pku_selection
+from app.models import ConsumptionItem, Festival, PackagingUnitType, Tombstone, \
+    User
 
 from test_config import BaseTestCase
 
@@ -91,3 +98,142 @@ class ConsumptionItemModelTest(BaseTestCase):
         toast = list(filter(lambda x: x.name == "Toast", shopping_list))
         self.assertTrue(toast is not None)
         self.assertEquals(4, toast[0].amount)
+
+    def test_export_docx(self):
+        setup_testdata()
+        items = session.query(ConsumptionItem).all()
+        for i, item in enumerate(items):
+            item.state = ConsumptionItemState.purchase
+            item.festival_id = 1
+            item.info = "info {}".format(i)
+        db.session.commit()
+
+        with self.app.test_request_context():
+            response = export_and_download_docx()
+        self.assertEqual("text/docx", response.content_type)
+        document = Document(BytesIO(response.get_data()))
+        rows = [[c.text for c in row.cells] for row in document.tables[0].rows]
+        self.assertEqual(["Article", "Amount", "Info"], rows[0])
+        self.assertEqual(["Sausage", "5 pcs", "info 0"], rows[1])
+        self.assertEqual(len(items) + 1, len(rows))
+
+    def test_export_docx_cache(self):
+        setup_testdata()
+        for item in session.query(ConsumptionItem).all():
+            item.state = ConsumptionItemState.purchase
+            item.festival_id = 1
+        db.session.commit()
+
+        with self.app.test_request_context():
+            first = export_and_download_docx().get_data()
+            hits = docx_cache.hits
+            self.assertEqual(first, export_and_download_docx().get_data())
+            self.assertEqual(hits + 1, docx_cache.hits)
+
+            # changes are noticed without an explicit invalidation
+            pku = session.query(PackagingUnitType).filter_by(internal_name="Pieces").first()
+            pku.abbreviation = "St"
+            db.session.commit()
+            document = Document(BytesIO(export_and_download_docx().get_data()))
+        self.assertEqual("5 St", document.tables[0].rows[1].cells[1].text)
+        self.assertEqual(hits + 1, docx_cache.hits)
+
+    def test_generation_statement_count(self):
+        setup_testdata(stock_amount=5, request_amount=5)
+        pcs = session.query(PackagingUnitType).filter_by(internal_name="Pieces").first()
+        for i in range(200):
+            db.session.add(ConsumptionItem(name="Sausage", pku_id=pcs.id,
+                                           amount=i % 10, requestor_id=2))
+            db.session.add(ConsumptionItem(name="Item {}".format(i), pku_id=pcs.id,
+                                           amount=1, requestor_id=2))
+        db.session.commit()
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            with self.app.test_request_context():
+                generate_shopping_list(festival_id=1, is_testing=True)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertLess(len(statements), 20)
+
+        purchase = session.query(ConsumptionItem).filter_by(
+            state=ConsumptionItemState.purchase)
+        sausages = purchase.filter_by(name="Sausage").all()
+        self.assertEqual(80, len(sausages))
+        self.assertTrue(all(0 < s.amount < 5 and s.festival_id == 1 for s in sausages))
+        self.assertEqual(200 + 3, purchase.filter(ConsumptionItem.name != "Sausage").count())
+        self.assertEqual(121, session.query(Tombstone).count())
+
+
+class DrinkPlanningTest(BaseTestCase):
+
+    def test_best_mix(self):
+        self.assertEqual((), best_mix(0, (24, 18)))
+        self.assertEqual(((18, 1),), best_mix(17, (24, 18)))
+        self.assertEqual(((24, 1), (18, 1)), best_mix(42, (24, 18)))
+        # 2x24 would leave 18 cans, 3x18 and 1x24 leave nothing
+        self.assertEqual(((24, 1), (18, 2)), best_mix(60, (24, 18)))
+        self.assertEqual(((6, 3),), best_mix(18, (6,)))
+
+    def test_plan_open_festivals(self):
+        setup_testdata()
+        create_festival("Wacken", start=date(2019, 8, 1), end=date(2019, 8, 1))
+        wacken = session.query(Festival).filter_by(title="Wacken").first()
+        for festival in session.query(Festival).all():
+            festival.is_closed = festival.id != wacken.id
+        empty = Festival(title="Empty", creator_id=1, start_date=date(2019, 9, 1),
+                         end_date=date(2019, 9, 2))
+        db.session.add(empty)
+        db.session.commit()
+
+        users = session.query(User).all()
+        self.assertEqual([wacken.id, empty.id],
+                         [d.festival_id for d in load_demand()])
+        plan = plan_drinks()[wacken.id]
+        self.assertEqual(sum(u.beer_demand for u in users), plan.beer)
+        packaged = sum(size * count for size, count in plan.beer_packages)
+        self.assertTrue(plan.beer <= packaged < plan.beer + 18)
+        self.assertEqual(0, plan_drinks([empty.id])[empty.id].beer)
+
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=["purchase", "plan"])
+        self.assertIn("Wacken (1 days)", result.output)
+        self.assertIn("Empty (2 days)", result.output)
+
+
+class ReferenceCacheTest(BaseTestCase):
+
+    def test_pku_selection_cache(self):
+        create_pku()
+        selection = get_pku_selection()
+        loads = reference_cache.loads
+        selection.append((0, "appended by a form"))
+        self.assertEqual(len(selection) - 1, len(get_pku_selection()))
+        self.assertEqual(loads, reference_cache.loads)
+
+        db.session.add(PackagingUnitType(name="Crates", internal_name="",
+                                         abbreviation="cr"))
+        db.session.commit()
+        invalidate_pku_references()
+        self.assertIn("cr", [a for _, a in get_pku_selection()])
+        self.assertEqual(loads + 1, reference_cache.loads)
+
+    def test_ttl(self):
+        now = [1000.0]
+        reference_cache.clock = lambda: now[0]
+        reference_cache.ttl = 60
+        self.addCleanup(setattr, reference_cache, "clock", time.monotonic)
+        create_pku()
+        get_pku_selection()
+        loads = reference_cache.loads
+        now[0] += 59
+        get_pku_selection()
+        self.assertEqual(loads, reference_cache.loads)
+        now[0] += 1
+        get_pku_selection()
+        self.assertEqual(loads + 1, reference_cache.loads)